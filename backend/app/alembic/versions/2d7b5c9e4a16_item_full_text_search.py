@@ -0,0 +1,40 @@
+"""item full-text search
+
+Revision ID: 2d7b5c9e4a16
+Revises: e6a93f1b0d28
+Create Date: 2026-10-18 22:14:37.915442
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '2d7b5c9e4a16'
+down_revision = 'e6a93f1b0d28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rewrites the table to fill the generated column
+    op.add_column('item', sa.Column(
+        'search_vector',
+        postgresql.TSVECTOR(),
+        sa.Computed(
+            "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(description, '')), 'B')",
+            persisted=True
+        ),
+        nullable=True
+    ))
+    op.create_index('ix_item_search_vector', 'item', ['search_vector'], unique=False, postgresql_using='gin')
+    # Replaced by the search index, equality lookups by title are never made
+    op.drop_index('ix_item_title', table_name='item')
+
+
+def downgrade():
+    op.create_index('ix_item_title', 'item', ['title'], unique=False)
+    op.drop_index('ix_item_search_vector', table_name='item')
+    op.drop_column('item', 'search_vector')
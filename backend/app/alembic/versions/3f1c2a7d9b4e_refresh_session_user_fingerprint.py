@@ -0,0 +1,28 @@
+"""refresh session user fingerprint index
+
+Revision ID: 3f1c2a7d9b4e
+Revises: 9df046c5f96a
+Create Date: 2026-10-18 10:12:41.518203
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7d9b4e'
+down_revision = '9df046c5f96a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep only the newest session of every user and device pair
+    op.execute(
+        'DELETE FROM refresh_session AS old USING refresh_session AS new '
+        'WHERE old.user_id = new.user_id AND old.fingerprint = new.fingerprint AND old.id < new.id'
+    )
+    op.create_index('ix_refresh_session_user_id_fingerprint', 'refresh_session', ['user_id', 'fingerprint'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_refresh_session_user_id_fingerprint', table_name='refresh_session')
@@ -0,0 +1,92 @@
+"""refresh token digest
+
+Revision ID: 5a8e6c0f2d71
+Revises: b7e4d19a0c53
+Create Date: 2026-10-18 11:48:05.371940
+
+Replaces stored refresh tokens with their HMAC-SHA256 digests. Digests of existing tokens are computed with
+the key of the application, set with `alembic -x refresh_token_key=... upgrade head` or taken from the
+SECRET_KEY environment variable. Without a key existing sessions are deleted and their users log in again.
+
+Rows are updated in batches of `-x refresh_token_batch_size`, every batch is a transaction of its own.
+"""
+import hashlib
+import hmac
+import os
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a8e6c0f2d71'
+down_revision = 'b7e4d19a0c53'
+branch_labels = None
+depends_on = None
+
+DEFAULT_BATCH_SIZE = 10_000
+
+
+def digest_key() -> bytes | None:
+    key = context.get_x_argument(as_dictionary=True).get('refresh_token_key', os.environ.get('SECRET_KEY'))
+    return key.encode() if key else None
+
+
+def token_digest(key: bytes, token: str) -> bytes:
+    # the digest of the application at this revision, a later change of it mustn't change this migration
+    return hmac.new(key, token.encode(), hashlib.sha256).digest()
+
+
+def backfill(key: bytes, batch_size: int, *, after_id: int = 0) -> int:
+    """
+    Set digests of sessions without one with id above `after_id`, returns the last updated id
+    """
+    bind = op.get_bind()
+    while True:
+        rows = bind.execute(
+            sa.text(
+                'SELECT id, refresh_token FROM refresh_session '
+                'WHERE id > :after_id AND refresh_token_hash IS NULL ORDER BY id LIMIT :limit'
+            ),
+            {'after_id': after_id, 'limit': batch_size}
+        ).fetchall()
+        if not rows:
+            return after_id
+        bind.execute(
+            sa.text(
+                'UPDATE refresh_session SET refresh_token_hash = batch.digest '
+                'FROM unnest(:ids, :digests) AS batch (id, digest) WHERE refresh_session.id = batch.id'
+            ),
+            {'ids': [row.id for row in rows], 'digests': [token_digest(key, row.refresh_token) for row in rows]}
+        )
+        after_id = rows[-1].id
+
+
+def upgrade():
+    batch_size = int(context.get_x_argument(as_dictionary=True).get('refresh_token_batch_size', DEFAULT_BATCH_SIZE))
+    key = digest_key()
+    op.add_column('refresh_session', sa.Column('refresh_token_hash', sa.LargeBinary(length=32), nullable=True))
+
+    if key is None:
+        op.execute('DELETE FROM refresh_session')
+    else:
+        # batches are committed one by one, so neither row locks nor WAL of the whole table pile up
+        with op.get_context().autocommit_block():
+            backfill(key, batch_size)
+        # sessions created meanwhile by a running application, the table is locked until the migration ends
+        op.execute('LOCK TABLE refresh_session IN SHARE ROW EXCLUSIVE MODE')
+        backfill(key, batch_size)
+
+    op.alter_column('refresh_session', 'refresh_token_hash', nullable=False)
+    op.create_index(op.f('ix_refresh_session_refresh_token_hash'), 'refresh_session', ['refresh_token_hash'], unique=True)
+    op.drop_index('ix_refresh_session_refresh_token', table_name='refresh_session')
+    op.drop_column('refresh_session', 'refresh_token')
+
+
+def downgrade():
+    # Tokens can't be restored from digests, so all sessions are dropped and users have to log in again
+    op.execute('DELETE FROM refresh_session')
+    op.add_column('refresh_session', sa.Column('refresh_token', sa.String(), nullable=False))
+    op.create_index('ix_refresh_session_refresh_token', 'refresh_session', ['refresh_token'], unique=True)
+    op.drop_index(op.f('ix_refresh_session_refresh_token_hash'), table_name='refresh_session')
+    op.drop_column('refresh_session', 'refresh_token_hash')
@@ -0,0 +1,98 @@
+"""item owner stats
+
+Revision ID: 8b3f0e6d1c45
+Revises: 2d7b5c9e4a16
+Create Date: 2026-10-18 23:02:51.240718
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b3f0e6d1c45'
+down_revision = '2d7b5c9e4a16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'item_owner_stats',
+        sa.Column('owner_id', sa.Integer(), nullable=False),
+        sa.Column('item_count', sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(['owner_id'], ['user.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('owner_id')
+    )
+    # Statement level triggers apply one aggregated change per owner,
+    # so bulk writes and imports don't update a counter row per item
+    op.execute('''
+        CREATE FUNCTION item_owner_stats_apply() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                DELETE FROM item_owner_stats;
+            ELSIF TG_OP = 'INSERT' THEN
+                INSERT INTO item_owner_stats (owner_id, item_count)
+                SELECT owner_id, count(*) FROM new_items WHERE owner_id IS NOT NULL GROUP BY owner_id
+                ON CONFLICT (owner_id) DO UPDATE SET item_count = item_owner_stats.item_count + excluded.item_count;
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE item_owner_stats SET item_count = item_owner_stats.item_count - removed.item_count
+                FROM (SELECT owner_id, count(*) AS item_count FROM old_items GROUP BY owner_id) AS removed
+                WHERE item_owner_stats.owner_id = removed.owner_id;
+            ELSE
+                -- only items moved to another owner change the counters
+                UPDATE item_owner_stats SET item_count = item_owner_stats.item_count - moved.item_count
+                FROM (
+                    SELECT owner_id, count(*) AS item_count FROM old_items
+                    WHERE NOT EXISTS (
+                        SELECT FROM new_items
+                        WHERE new_items.id = old_items.id AND new_items.owner_id IS NOT DISTINCT FROM old_items.owner_id
+                    )
+                    GROUP BY owner_id
+                ) AS moved
+                WHERE item_owner_stats.owner_id = moved.owner_id;
+                INSERT INTO item_owner_stats (owner_id, item_count)
+                SELECT owner_id, count(*) FROM new_items
+                WHERE owner_id IS NOT NULL AND NOT EXISTS (
+                    SELECT FROM old_items
+                    WHERE old_items.id = new_items.id AND old_items.owner_id IS NOT DISTINCT FROM new_items.owner_id
+                )
+                GROUP BY owner_id
+                ON CONFLICT (owner_id) DO UPDATE SET item_count = item_owner_stats.item_count + excluded.item_count;
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    ''')
+    op.execute(
+        'CREATE TRIGGER item_owner_stats_insert AFTER INSERT ON item REFERENCING NEW TABLE AS new_items '
+        'FOR EACH STATEMENT EXECUTE FUNCTION item_owner_stats_apply()'
+    )
+    op.execute(
+        'CREATE TRIGGER item_owner_stats_update AFTER UPDATE ON item '
+        'REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items '
+        'FOR EACH STATEMENT EXECUTE FUNCTION item_owner_stats_apply()'
+    )
+    op.execute(
+        'CREATE TRIGGER item_owner_stats_delete AFTER DELETE ON item REFERENCING OLD TABLE AS old_items '
+        'FOR EACH STATEMENT EXECUTE FUNCTION item_owner_stats_apply()'
+    )
+    op.execute(
+        'CREATE TRIGGER item_owner_stats_truncate AFTER TRUNCATE ON item '
+        'FOR EACH STATEMENT EXECUTE FUNCTION item_owner_stats_apply()'
+    )
+    # Counters are filled under a lock, so no write is missed between the backfill and the triggers
+    op.execute('LOCK TABLE item IN SHARE MODE')
+    op.execute(
+        'INSERT INTO item_owner_stats (owner_id, item_count) '
+        'SELECT owner_id, count(*) FROM item WHERE owner_id IS NOT NULL GROUP BY owner_id'
+    )
+
+
+def downgrade():
+    op.execute('DROP TRIGGER item_owner_stats_truncate ON item')
+    op.execute('DROP TRIGGER item_owner_stats_delete ON item')
+    op.execute('DROP TRIGGER item_owner_stats_update ON item')
+    op.execute('DROP TRIGGER item_owner_stats_insert ON item')
+    op.execute('DROP FUNCTION item_owner_stats_apply()')
+    op.drop_table('item_owner_stats')
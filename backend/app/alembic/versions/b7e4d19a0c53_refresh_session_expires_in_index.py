@@ -0,0 +1,23 @@
+"""refresh session expires_in index
+
+Revision ID: b7e4d19a0c53
+Revises: 3f1c2a7d9b4e
+Create Date: 2026-10-18 11:03:27.904116
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4d19a0c53'
+down_revision = '3f1c2a7d9b4e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_refresh_session_expires_in'), 'refresh_session', ['expires_in'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_refresh_session_expires_in'), table_name='refresh_session')
@@ -0,0 +1,27 @@
+"""keyset pagination indexes
+
+Revision ID: c41d8e2b7f90
+Revises: 5a8e6c0f2d71
+Create Date: 2026-10-18 13:20:54.182733
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d8e2b7f90'
+down_revision = '5a8e6c0f2d71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_item_owner_id_created_at_id', 'item', ['owner_id', 'created_at', 'id'], unique=False)
+    op.create_index('ix_item_created_at_id', 'item', ['created_at', 'id'], unique=False)
+    op.create_index('ix_user_created_at_id', 'user', ['created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_created_at_id', table_name='user')
+    op.drop_index('ix_item_created_at_id', table_name='item')
+    op.drop_index('ix_item_owner_id_created_at_id', table_name='item')
@@ -0,0 +1,31 @@
+"""drop redundant indexes
+
+Revision ID: e6a93f1b0d28
+Revises: c41d8e2b7f90
+Create Date: 2026-10-18 21:07:12.604318
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a93f1b0d28'
+down_revision = 'c41d8e2b7f90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Primary keys are indexed already
+    op.drop_index('ix_user_id', table_name='user')
+    op.drop_index('ix_item_id', table_name='item')
+    op.drop_index('ix_refresh_session_id', table_name='refresh_session')
+    # Never used by a query, only slows down writes of unbounded descriptions
+    op.drop_index('ix_item_description', table_name='item')
+
+
+def downgrade():
+    op.create_index('ix_item_description', 'item', ['description'], unique=False)
+    op.create_index('ix_refresh_session_id', 'refresh_session', ['id'], unique=False)
+    op.create_index('ix_item_id', 'item', ['id'], unique=False)
+    op.create_index('ix_user_id', 'user', ['id'], unique=False)
@@ -0,0 +1,166 @@
+"""item owner hash partitions
+
+Revision ID: f0c7a4d2e915
+Revises: 8b3f0e6d1c45
+Create Date: 2026-10-19 01:12:37.904561
+
+Converts item to a table hash partitioned by owner_id, so owner-scoped reads, writes and vacuum
+touch only one partition and its indexes. The number of partitions is set with
+`alembic -x item_partitions=16 upgrade head`, rows are copied in batches of `-x item_partition_batch_size`.
+
+Rows are copied to a partitioned shadow table while the application keeps running,
+a trigger mirrors concurrent writes, and the tables are swapped under a short exclusive lock.
+"""
+from alembic import context, op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f0c7a4d2e915'
+down_revision = '8b3f0e6d1c45'
+branch_labels = None
+depends_on = None
+
+DEFAULT_PARTITIONS = 8
+DEFAULT_BATCH_SIZE = 50_000
+
+COLUMNS = 'id, title, description, owner_id, created_at'
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+# indexes of the model, created on the partitioned table with the suffix until the old table is dropped
+INDEXES = {
+    'ix_item_owner_id_created_at_id': 'btree (owner_id, created_at, id)',
+    'ix_item_created_at_id': 'btree (created_at, id)',
+    'ix_item_search_vector': 'gin (search_vector)',
+}
+STATS_TRIGGERS = {
+    'item_owner_stats_insert': 'AFTER INSERT ON item REFERENCING NEW TABLE AS new_items',
+    'item_owner_stats_update': 'AFTER UPDATE ON item REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items',
+    'item_owner_stats_delete': 'AFTER DELETE ON item REFERENCING OLD TABLE AS old_items',
+    'item_owner_stats_truncate': 'AFTER TRUNCATE ON item',
+}
+
+
+def x_int(name: str, default: int) -> int:
+    value = int(context.get_x_argument(as_dictionary=True).get(name, default))
+    if value < 1:
+        raise ValueError(f'{name} must be positive')
+    return value
+
+
+def create_item_table(name: str, partitions: int | None) -> None:
+    # primary key of a partitioned table must contain the partition key,
+    # id stays unique as it comes from the sequence, and it's still the leading column for lookups by id
+    primary_key = 'PRIMARY KEY (id, owner_id)' if partitions else 'PRIMARY KEY (id)'
+    partition_by = ' PARTITION BY HASH (owner_id)' if partitions else ''
+    op.execute(f'''
+        CREATE TABLE {name} (
+            id integer NOT NULL DEFAULT nextval('item_id_seq'),
+            title varchar,
+            description varchar,
+            owner_id integer NOT NULL,
+            created_at timestamp without time zone NOT NULL,
+            search_vector tsvector GENERATED ALWAYS AS ({SEARCH_VECTOR}) STORED,
+            CONSTRAINT {name}_pkey {primary_key},
+            CONSTRAINT {name}_owner_id_fkey FOREIGN KEY (owner_id) REFERENCES "user" (id)
+        ){partition_by}
+    ''')
+    for remainder in range(partitions or 0):
+        op.execute(
+            f'CREATE TABLE item_p{remainder} PARTITION OF {name} '
+            f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})'
+        )
+    for index, definition in INDEXES.items():
+        op.execute(f'CREATE INDEX {index}_new ON {name} USING {definition}')
+
+
+def swap_item_table(name: str) -> None:
+    """
+    Replace item with `name` table, must run under an exclusive lock of item
+    """
+    op.execute('ALTER TABLE item RENAME TO item_old')
+    op.execute(f'ALTER TABLE {name} RENAME TO item')
+    op.execute('ALTER SEQUENCE item_id_seq OWNED BY item.id')
+    op.execute('DROP TABLE item_old')
+    op.execute(f'ALTER TABLE item RENAME CONSTRAINT {name}_pkey TO item_pkey')
+    op.execute(f'ALTER TABLE item RENAME CONSTRAINT {name}_owner_id_fkey TO item_owner_id_fkey')
+    for index in INDEXES:
+        op.execute(f'ALTER INDEX {index}_new RENAME TO {index}')
+    for trigger, event in STATS_TRIGGERS.items():
+        op.execute(f'CREATE TRIGGER {trigger} {event} FOR EACH STATEMENT EXECUTE FUNCTION item_owner_stats_apply()')
+
+
+def upgrade():
+    partitions = x_int('item_partitions', DEFAULT_PARTITIONS)
+    batch_size = x_int('item_partition_batch_size', DEFAULT_BATCH_SIZE)
+    if op.get_bind().exec_driver_sql('SELECT EXISTS (SELECT FROM item WHERE owner_id IS NULL)').scalar():
+        raise RuntimeError('Items without owner can not be partitioned by owner_id, assign or delete them first')
+
+    with op.get_context().autocommit_block():
+        # leftovers of an interrupted run
+        op.execute('DROP TRIGGER IF EXISTS item_partition_sync ON item')
+        op.execute('DROP FUNCTION IF EXISTS item_partition_sync()')
+        op.execute('DROP TABLE IF EXISTS item_partitioned')
+        op.execute('ALTER TABLE item DROP CONSTRAINT IF EXISTS item_owner_id_not_null')
+
+        # owner_id becomes NOT NULL before rows are copied, so an item without owner written meanwhile
+        # fails right away instead of the mirror trigger. The check is validated without blocking writes,
+        # then SET NOT NULL relies on it and doesn't scan the table under its exclusive lock
+        op.execute('ALTER TABLE item ADD CONSTRAINT item_owner_id_not_null CHECK (owner_id IS NOT NULL) NOT VALID')
+        op.execute('ALTER TABLE item VALIDATE CONSTRAINT item_owner_id_not_null')
+        op.execute('ALTER TABLE item ALTER COLUMN owner_id SET NOT NULL')
+        op.execute('ALTER TABLE item DROP CONSTRAINT item_owner_id_not_null')
+
+        create_item_table('item_partitioned', partitions)
+        op.execute(f'''
+            CREATE FUNCTION item_partition_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    DELETE FROM item_partitioned WHERE id = OLD.id AND owner_id = OLD.owner_id;
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO item_partitioned ({COLUMNS})
+                    VALUES (NEW.id, NEW.title, NEW.description, NEW.owner_id, NEW.created_at);
+                END IF;
+                RETURN NULL;
+            END
+            $$
+        ''')
+        op.execute(
+            'CREATE TRIGGER item_partition_sync AFTER INSERT OR UPDATE OR DELETE ON item '
+            'FOR EACH ROW EXECUTE FUNCTION item_partition_sync()'
+        )
+
+        # Rows written after the trigger was created are already mirrored, the rest is copied in batches.
+        # Every batch is a transaction of its own. Source rows are locked, so a concurrent update or delete
+        # either finishes first and is seen by the copy, or waits and is mirrored after the row is copied
+        bind = op.get_bind()
+        last_id = bind.exec_driver_sql('SELECT max(id) FROM item').scalar() or 0
+        start = 0
+        while start < last_id:
+            end = bind.exec_driver_sql(
+                f'SELECT id FROM item WHERE id > {start} ORDER BY id OFFSET {batch_size - 1} LIMIT 1'
+            ).scalar()
+            end = min(end or last_id, last_id)
+            op.execute(f'''
+                INSERT INTO item_partitioned ({COLUMNS})
+                SELECT {COLUMNS} FROM item WHERE id > {start} AND id <= {end} FOR SHARE
+                ON CONFLICT DO NOTHING
+            ''')
+            start = end
+        op.execute('ANALYZE item_partitioned')
+
+    op.execute('LOCK TABLE item IN ACCESS EXCLUSIVE MODE')
+    op.execute('DROP TRIGGER item_partition_sync ON item')
+    op.execute('DROP FUNCTION item_partition_sync()')
+    swap_item_table('item_partitioned')
+
+
+def downgrade():
+    op.execute('LOCK TABLE item IN ACCESS EXCLUSIVE MODE')
+    op.execute('DROP TABLE IF EXISTS item_unpartitioned')
+    create_item_table('item_unpartitioned', None)
+    op.execute(f'INSERT INTO item_unpartitioned ({COLUMNS}) SELECT {COLUMNS} FROM item')
+    swap_item_table('item_unpartitioned')
+    op.execute('ALTER TABLE item ALTER COLUMN owner_id DROP NOT NULL')
@@ -0,0 +1,22 @@
+from typing import Any
+
+from fastapi import APIRouter, Depends
+
+from app import schemas
+from app.api import deps
+from app.core.response_cache import response_cache
+
+router = APIRouter()
+
+
+# noinspection PyUnusedLocal
+@router.get("/stats", response_model=schemas.ResponseCacheStats)
+async def read_response_cache_stats(
+        *,
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_superuser),  # Necessary for credentials validation
+) -> Any:
+    """
+    Hits, misses and hit ratio of the response cache by endpoint, counted by the process serving the request.
+    Only for superusers.
+    """
+    return response_cache.stats()
@@ -1,122 +1,434 @@
+import functools
 from typing import Any
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Body, Depends, File, Header, HTTPException, Query, Request, Response, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlalchemy.engine import Row
+from sqlalchemy.sql import ColumnElement
 from starlette import status
 
 from app import crud, models, schemas
 from app.api import deps
+from app.core import etag, export, importer
+from app.core.config import settings
+from app.core.response_cache import response_cache
+from app.core.serialization import ORMEncoder
+from app.crud.batching import WriteBatcher
+from app.crud.loader import Loader
+from app.db.runner import SessionRunner, session_runner
 
 router = APIRouter()
 
+item_encoder = ORMEncoder(schemas.Item)
+
+
+async def create_items_batch(rows: list[dict[str, Any]]) -> list[models.Item | Exception]:
+    async with session_runner() as db:
+        return await db.run(crud.item.create_each, objs_in=rows)
+
+
+item_create_batcher = WriteBatcher(
+    create_items_batch,
+    max_size=settings.ITEMS_WRITE_BATCH_MAX_SIZE,
+    max_wait=settings.ITEMS_WRITE_BATCH_MAX_WAIT_MS / 1000
+)
+
+
+def check_bulk_size(size: int, ids: list[int] | None = None) -> None:
+    if size > settings.ITEMS_BULK_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.ITEMS_BULK_MAX_SIZE} items per request"
+        )
+    if ids is not None and len(set(ids)) != len(ids):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Item ids must be unique"
+        )
+
+
+def can_read_item(item: models.Item | Row, current_user: schemas.UserInDB) -> bool:
+    return crud.user.is_superuser(current_user) or item.owner_id == current_user.id
+
+
+def version_condition(if_match: str | None) -> ColumnElement | None:
+    """
+    Condition on the item version required by `If-Match` header, None when any version is fine
+    """
+    expected = None if if_match is None else etag.versions(if_match)
+    return None if expected is None else models.Item.updated_at.in_(expected)
+
+
+def check_precondition(item: Row | None, current_user: schemas.UserInDB) -> None:
+    """
+    Raise 412 when the update of `item` didn't happen because of `If-Match`, not because of permissions
+    """
+    if item is not None and can_read_item(item, current_user):
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="Item was changed"
+        )
+
+
+# noinspection PyShadowingBuiltins
+def check_bulk_access(
+        items: list[models.Item],
+        ids: list[int],
+        current_user: schemas.UserInDB
+) -> dict[int, schemas.ItemBulkResult | None]:
+    """
+    Apply per item checks of single item endpoints to `ids`, None marks items allowed to be changed
+    """
+    owners = {item.id: item.owner_id for item in items}
+    results = {}
+    for id in ids:
+        if id not in owners:
+            results[id] = schemas.ItemBulkResult(
+                id=id, status_code=status.HTTP_404_NOT_FOUND, detail="Item not found"
+            )
+        elif not crud.user.is_superuser(current_user) and (owners[id] != current_user.id):
+            results[id] = schemas.ItemBulkResult(
+                id=id, status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions"
+            )
+        else:
+            results[id] = None
+    return results
+
+
+# noinspection PyShadowingBuiltins
+def bulk_results(
+        results: dict[int, schemas.ItemBulkResult | None],
+        items: list[models.Item]
+) -> list[schemas.ItemBulkResult]:
+    """
+    Results in request order, changed `items` fill in the gaps left by `check_bulk_access`
+    """
+    changed = {item.id: item for item in items}
+    for id, result in results.items():
+        if result is not None:
+            continue
+        if id in changed:
+            results[id] = schemas.ItemBulkResult(id=id, status_code=status.HTTP_200_OK, item=changed[id])
+        else:
+            # removed by a concurrent request after the checks
+            results[id] = schemas.ItemBulkResult(
+                id=id, status_code=status.HTTP_404_NOT_FOUND, detail="Item not found"
+            )
+    return list(results.values())
+
 
 @router.get("/", response_model=list[schemas.Item])
-def read_items(
-        db: Session = Depends(deps.get_db),
+async def read_items(
+        db: SessionRunner = Depends(deps.get_read_db),
         *,
-        current_user: models.User = Depends(deps.get_current_active_user),
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
+        request: Request,
+        response: Response,
         offset: int = 0,
         limit: int = 100,
+        cursor: str | None = None,
+        include_total: bool = False,
+        ids: list[int] | None = Depends(deps.get_requested_ids),
+        item_loader: Loader[models.Item] = Depends(deps.get_item_loader),
+        if_none_match: str | None = Header(None),
 ) -> Any:
     """
-    Retrieve items.
+    Retrieve items. Pass `X-Next-Cursor` header of the response as `cursor` to get the next page.
+    With `include_total` the number of all items visible to the user is returned in `X-Total-Count` header.
+    With `ids` only items with these ids are returned in the same order, with one query,
+    items which don't exist or can't be read by the user are left out.
+    Pages have an `ETag`, when it's sent back in `If-None-Match` and the page didn't change, 304 is returned.
     """
+    if ids is not None:
+        items = [item for item in await item_loader.get_many(ids) if item and can_read_item(item, current_user)]
+        return item_encoder.response(items, response)
     if crud.user.is_superuser(current_user):
-        items = crud.item.get_multi(db, offset=offset, limit=limit)
+        owner_id = None
+        get_page = functools.partial(db.run, crud.item.get_multi, offset=offset, limit=limit, cursor=cursor)
     else:
-        items = crud.item.get_multi_by_owner(
-            db=db, owner_id=current_user.id, offset=offset, limit=limit
+        owner_id = current_user.id
+        get_page = functools.partial(
+            db.run, crud.item.get_multi_by_owner, owner_id=owner_id, offset=offset, limit=limit, cursor=cursor
         )
-    return items
+    cached = await response_cache.lookup_async(
+        "read_items", request, principal=current_user.id,
+        tags=[crud.item.pages_tag(owner_id), crud.user.cache_tag(current_user.id)]
+    )
+    if (hit := cached.response(if_none_match)) is not None:
+        return hit
+    total = None
+    if include_total:
+        total, _ = await db.run(crud.item.count, owner_id=owner_id, exact=settings.ITEMS_TOTAL_COUNT_EXACT)
+    if if_none_match is not None:
+        # versions of the page come from an index-only scan, rows are loaded only when something changed
+        tag = etag.page_tag(await get_page(columns=crud.item.version_columns), total=total)
+        if etag.matches(if_none_match, tag):
+            return etag.not_modified(tag)
+    items = await get_page()
+    next_cursor = crud.item.next_cursor(items, limit=limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if total is not None:
+        response.headers["X-Total-Count"] = str(total)
+    response.headers["ETag"] = etag.page_tag(items, total=total)
+    return await cached.store_async(item_encoder.encode(items), response)
+
+
+@router.get("/stats", response_model=schemas.ItemStats)
+async def read_item_stats(
+        db: SessionRunner = Depends(deps.get_read_db),
+        *,
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
+        offset: int = 0,
+        limit: int = 100,
+) -> Any:
+    """
+    Retrieve item counts. Superusers get the number of all items and the owners with most items,
+    other users the number of their own items.
+    """
+    if not crud.user.is_superuser(current_user):
+        total, _ = await db.run(crud.item.count, owner_id=current_user.id)
+        return schemas.ItemStats(
+            total=total, owners=[schemas.ItemOwnerCount(owner_id=current_user.id, item_count=total)]
+        )
+    total, estimated = await db.run(crud.item.count, exact=settings.ITEMS_TOTAL_COUNT_EXACT)
+    owners = await db.run(crud.item.owner_counts, offset=offset, limit=limit)
+    return schemas.ItemStats(total=total, estimated=estimated, owners=owners)
 
 
 @router.post("/", response_model=schemas.Item)
-def create_item(
-        db: Session = Depends(deps.get_db),
+async def create_item(
+        db: SessionRunner = Depends(deps.get_db),
         *,
-        current_user: models.User = Depends(deps.get_current_active_user),
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
         item_in: schemas.ItemCreate,
 ) -> Any:
     """
     Create new item.
     """
-    item = crud.item.create_with_owner(db=db, obj_in=item_in, owner_id=current_user.id)
+    if settings.ITEMS_WRITE_COALESCING:
+        return await item_create_batcher.submit({**jsonable_encoder(item_in), "owner_id": current_user.id})
+    item = await db.run(crud.item.create_with_owner, obj_in=item_in, owner_id=current_user.id)
     return item
 
 
+@router.get("/search", response_model=list[schemas.Item])
+async def search_items(
+        db: SessionRunner = Depends(deps.get_read_db),
+        *,
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
+        response: Response,
+        q: str = Query(..., min_length=1),
+        offset: int = 0,
+        limit: int = 100,
+        cursor: str | None = None,
+) -> Any:
+    """
+    Search items by words of title and description, best matches first.
+    Supports quoted phrases, `or` and `-` to exclude words.
+    Pass `X-Next-Cursor` header of the response as `cursor` to get the next page.
+    """
+    owner_id = None if crud.user.is_superuser(current_user) else current_user.id
+    page = await db.run(crud.item.search, q=q, owner_id=owner_id, offset=offset, limit=limit, cursor=cursor)
+    next_cursor = crud.item.search_cursor(page, limit=limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return item_encoder.response([item for item, rank in page], response)
+
+
+# noinspection PyShadowingBuiltins
+@router.get("/export", response_class=StreamingResponse)
+async def export_items(
+        db: SessionRunner = Depends(deps.get_read_db),
+        *,
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
+        format: schemas.ExportFormat = schemas.ExportFormat.ndjson,
+) -> Any:
+    """
+    Stream all items as NDJSON, CSV or Arrow IPC stream. Superusers get all items, other users their own ones.
+    """
+    encoder = export.get_encoder(format, crud.item.export_columns)
+    owner_id = None if crud.user.is_superuser(current_user) else current_user.id
+    batches = db.iterate(
+        crud.item.stream,
+        owner_id=owner_id,
+        batch_size=settings.ITEMS_EXPORT_BATCH_SIZE,
+        idle_timeout=settings.ITEMS_EXPORT_IDLE_TIMEOUT_SECONDS
+    )
+    return StreamingResponse(
+        export.encode_stream_async(encoder, batches),
+        media_type=encoder.media_type,
+        headers={"Content-Disposition": f'attachment; filename="items.{encoder.extension}"'}
+    )
+
+
+# noinspection PyShadowingBuiltins
+@router.post("/import", response_model=schemas.ItemImportReport)
+async def import_items(
+        db: SessionRunner = Depends(deps.get_threaded_db),
+        *,
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
+        file: UploadFile = File(...),
+        format: schemas.ImportFormat = schemas.ImportFormat.ndjson,
+) -> Any:
+    """
+    Import items owned by current user from NDJSON or CSV file.
+    Valid rows are imported in one transaction, invalid ones are skipped and reported.
+    """
+    return await db.run(importer.import_items, file.file, import_format=format, owner_id=current_user.id)
+
+
+@router.post("/bulk", response_model=list[schemas.Item])
+async def create_items(
+        db: SessionRunner = Depends(deps.get_db),
+        *,
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
+        items_in: list[schemas.ItemCreate],
+) -> Any:
+    """
+    Create many items in one transaction.
+    """
+    check_bulk_size(len(items_in))
+    items = await db.run(crud.item.create_multi_with_owner, objs_in=items_in, owner_id=current_user.id)
+    return items
+
+
+@router.put("/bulk", response_model=list[schemas.ItemBulkResult])
+async def update_items(
+        db: SessionRunner = Depends(deps.get_db),
+        *,
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
+        items_in: list[schemas.ItemBulkUpdate],
+) -> Any:
+    """
+    Update many items in one transaction.
+    Every item gets a result with the status code `PUT /items/{id}` would respond with, failed items are skipped.
+    """
+    ids = [item_in.id for item_in in items_in]
+    check_bulk_size(len(ids), ids)
+    results = check_bulk_access(await db.run(crud.item.get_many, ids=ids), ids, current_user)
+    items = await db.run(
+        crud.item.update_multi,
+        objs_in=[item_in.dict(exclude_unset=True) for item_in in items_in if results[item_in.id] is None]
+    )
+    return bulk_results(results, items)
+
+
+@router.delete("/bulk", response_model=list[schemas.ItemBulkResult])
+async def delete_items(
+        db: SessionRunner = Depends(deps.get_db),
+        *,
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
+        ids: list[int] = Body(...),
+) -> Any:
+    """
+    Delete many items in one transaction.
+    Every item gets a result with the status code `DELETE /items/{id}` would respond with, failed items are skipped.
+    """
+    check_bulk_size(len(ids), ids)
+    results = check_bulk_access(await db.run(crud.item.get_many, ids=ids), ids, current_user)
+    items = await db.run(crud.item.remove_multi, ids=[id for id in ids if results[id] is None])
+    return bulk_results(results, items)
+
+
 # noinspection PyShadowingBuiltins
 @router.put("/{id}", response_model=schemas.Item)
-def update_item(
-        db: Session = Depends(deps.get_db),
+async def update_item(
+        db: SessionRunner = Depends(deps.get_db),
         *,
-        current_user: models.User = Depends(deps.get_current_active_user),
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
         id: int,
         item_in: schemas.ItemUpdate,
+        response: Response,
+        if_match: str | None = Header(None),
 ) -> Any:
     """
-    Update an item.
+    Update an item. With `If-Match` holding the `ETag` of the item, it's updated only if it didn't change since,
+    otherwise 412 is returned.
     """
-    item = crud.item.get(db=db, id=id)
-    if not item:
+    owner_id = None if crud.user.is_superuser(current_user) else current_user.id
+    condition = version_condition(if_match)
+    found, item = await db.run(
+        crud.item.update_by_owner, id=id, obj_in=item_in, owner_id=owner_id, condition=condition
+    )
+    if not found:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Item not found"
         )
-    if not crud.user.is_superuser(current_user) and (item.owner_id != current_user.id):
+    if not item:
+        if condition is not None:
+            check_precondition(await db.run(crud.item.get_row, id=id, columns=["owner_id"]), current_user)
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not enough permissions"
         )
-    item = crud.item.update(db=db, db_obj=item, obj_in=item_in)
+    response.headers["ETag"] = etag.row_tag(item.updated_at)
     return item
 
 
 # noinspection PyShadowingBuiltins
 @router.get("/{id}", response_model=schemas.Item)
-def read_item(
-        db: Session = Depends(deps.get_db),
+async def read_item(
+        db: SessionRunner = Depends(deps.get_read_db),
         *,
-        current_user: models.User = Depends(deps.get_current_active_user),
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
         id: int,
+        request: Request,
+        response: Response,
+        item_loader: Loader[models.Item] = Depends(deps.get_item_loader),
+        if_none_match: str | None = Header(None),
 ) -> Any:
     """
-    Get item by ID.
+    Get item by ID. Returns 304 when the `ETag` sent in `If-None-Match` is still the one of the item.
     """
-    item = crud.item.get(db=db, id=id)
+    cached = await response_cache.lookup_async(
+        "read_item", request, principal=current_user.id,
+        tags=[crud.item.cache_tag(id), crud.user.cache_tag(current_user.id)]
+    )
+    if (hit := cached.response(if_none_match)) is not None:
+        return hit
+    if if_none_match is not None:
+        row = await db.run(crud.item.get_row, id=id, columns=["owner_id", "updated_at"])
+        if row and can_read_item(row, current_user) and etag.matches(if_none_match, etag.row_tag(row.updated_at)):
+            return etag.not_modified(etag.row_tag(row.updated_at))
+    item = await item_loader.get(id)
     if not item:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Item not found"
         )
-    if not crud.user.is_superuser(current_user) and (item.owner_id != current_user.id):
+    if not can_read_item(item, current_user):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not enough permissions"
         )
-    return item
+    response.headers["ETag"] = etag.row_tag(item.updated_at)
+    return await cached.store_async(item_encoder.encode_one(item), response)
 
 
 # noinspection PyShadowingBuiltins
 @router.delete("/{id}", response_model=schemas.Item)
-def delete_item(
-        db: Session = Depends(deps.get_db),
+async def delete_item(
+        db: SessionRunner = Depends(deps.get_db),
         *,
-        current_user: models.User = Depends(deps.get_current_active_user),
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
         id: int,
 ) -> Any:
     """
     Delete an item.
     """
-    item = crud.item.get(db=db, id=id)
-    if not item:
+    owner_id = None if crud.user.is_superuser(current_user) else current_user.id
+    found, item = await db.run(crud.item.remove_by_owner, id=id, owner_id=owner_id)
+    if not found:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Item not found"
         )
-    if not crud.user.is_superuser(current_user) and (item.owner_id != current_user.id):
+    if not item:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not enough permissions"
         )
-    item = crud.item.remove(db=db, id=id)
     return item
@@ -1,60 +1,89 @@
 from typing import Any
 
-from fastapi import APIRouter, Body, Depends, HTTPException
-from fastapi.encoders import jsonable_encoder
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Request, Response
 from pydantic.networks import EmailStr
-from sqlalchemy.orm import Session
 from starlette import status
 
 from app import crud, models, schemas
 from app.api import deps
+from app.core import etag, security
 from app.core.config import settings
+from app.core.response_cache import response_cache
+from app.core.serialization import ORMEncoder
+from app.crud.loader import Loader
+from app.db.runner import SessionRunner
 
 router = APIRouter()
 
+user_encoder = ORMEncoder(schemas.User)
+
+
+def own_user_update(**fields: Any) -> schemas.UserUpdate:
+    """
+    Update of the current user with only the fields sent by them. Other fields are never taken
+    from the cached snapshot of the user, which may be older than the row, e.g. privileges revoked meanwhile
+    """
+    return schemas.UserUpdate(**{field: value for field, value in fields.items() if value is not None})
+
 
-# noinspection PyUnusedLocal
 @router.get("/", response_model=list[schemas.User])
-def read_users(
-        db: Session = Depends(deps.get_db),
+async def read_users(
+        db: SessionRunner = Depends(deps.get_read_db),
         *,
-        current_user: models.User = Depends(deps.get_current_active_superuser),  # Necessary for credentials validation
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
+        response: Response,
         offset: int = 0,
         limit: int = 100,
+        cursor: str | None = None,
+        ids: list[int] | None = Depends(deps.get_requested_ids),
+        user_loader: Loader[models.User] = Depends(deps.get_user_loader),
 ) -> Any:
     """
-    Retrieve users. Only for superusers.
+    Retrieve users. Only for superusers. Pass `X-Next-Cursor` header of the response as `cursor` to get the next page.
+    With `ids` only users with these ids are returned in the same order, with one query. Then the endpoint is open
+    to all users, like `GET /users/{user_id}`, and users which don't exist or can't be read are left out.
     """
-    users = crud.user.get_multi(db, offset=offset, limit=limit)
-    return users
+    if ids is not None:
+        users = [
+            user for user in await user_loader.get_many(ids)
+            if user and (user.id == current_user.id or crud.user.is_superuser(current_user))
+        ]
+        return user_encoder.response(users, response)
+    await deps.get_current_active_superuser(current_user)
+    users = await db.run(crud.user.get_multi, offset=offset, limit=limit, cursor=cursor)
+    next_cursor = crud.user.next_cursor(users, limit=limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return user_encoder.response(users, response)
 
 
 # noinspection PyUnusedLocal
 @router.post("/", response_model=schemas.User)
-def create_user(
-        db: Session = Depends(deps.get_db),
+async def create_user(
+        db: SessionRunner = Depends(deps.get_db),
         *,
-        current_user: models.User = Depends(deps.get_current_active_superuser),  # Necessary for credentials validation
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_superuser),  # Necessary for credentials validation
         user_in: schemas.UserCreate,
 ) -> Any:
     """
     Create new user. Only for superusers.
     """
-    user = crud.user.get_by_email(db, email=user_in.email)
+    user = await db.run(crud.user.get_by_email, email=user_in.email)
     if user:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="The user with this username already exists in the system.",
         )
-    user = crud.user.create(db, obj_in=user_in)
+    hashed_password = await security.get_password_hash_async(user_in.password)
+    user = await db.run(crud.user.create, obj_in=user_in, hashed_password=hashed_password)
     return user
 
 
 @router.put("/me", response_model=schemas.User)
-def update_user_me(
-        db: Session = Depends(deps.get_db),
+async def update_user_me(
+        db: SessionRunner = Depends(deps.get_db),
         *,
-        current_user: models.User = Depends(deps.get_current_active_user),
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
         password: str = Body(None),
         full_name: str = Body(None),
         email: EmailStr = Body(None),
@@ -62,32 +91,33 @@ def update_user_me(
     """
     Update own user.
     """
-    current_user_data = jsonable_encoder(current_user)
-    user_in = schemas.UserUpdate(**current_user_data)
-    if password is not None:
-        user_in.password = password
-    if full_name is not None:
-        user_in.full_name = full_name
-    if email is not None:
-        user_in.email = email
-    user = crud.user.update(db, db_obj=current_user, obj_in=user_in)
+    user_in = own_user_update(password=password, full_name=full_name, email=email)
+    hashed_password = await security.get_password_hash_async(password) if password else None
+    user = await db.run(crud.user.get, id=current_user.id)
+    user = await db.run(crud.user.update, db_obj=user, obj_in=user_in, hashed_password=hashed_password)
     return user
 
 
 @router.get("/me", response_model=schemas.User)
-def read_user_me(
+async def read_user_me(
         *,
-        current_user: models.User = Depends(deps.get_current_active_user),
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
+        response: Response,
+        if_none_match: str | None = Header(None),
 ) -> Any:
     """
-    Get current user.
+    Get current user. Returns 304 when the `ETag` sent in `If-None-Match` is still the one of the user.
     """
+    tag = etag.row_tag(current_user.updated_at)
+    if etag.matches(if_none_match, tag):
+        return etag.not_modified(tag)
+    response.headers["ETag"] = tag
     return current_user
 
 
 @router.post("/open", response_model=schemas.User)
-def create_user_open(
-        db: Session = Depends(deps.get_db),
+async def create_user_open(
+        db: SessionRunner = Depends(deps.get_db),
         *,
         password: str = Body(...),
         email: EmailStr = Body(...),
@@ -101,55 +131,65 @@ def create_user_open(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Open user registration is forbidden on this server",
         )
-    user = crud.user.get_by_email(db, email=email)
+    user = await db.run(crud.user.get_by_email, email=email)
     if user:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="The user with this username already exists in the system",
         )
     user_in = schemas.UserCreate(password=password, email=email, full_name=full_name)
-    user = crud.user.create(db, obj_in=user_in)
+    hashed_password = await security.get_password_hash_async(password)
+    user = await db.run(crud.user.create, obj_in=user_in, hashed_password=hashed_password)
     return user
 
 
 @router.get("/{user_id}", response_model=schemas.User)
-def read_user_by_id(
-        db: Session = Depends(deps.get_db),
+async def read_user_by_id(
+        db: SessionRunner = Depends(deps.get_read_db),
         *,
-        current_user: models.User = Depends(deps.get_current_active_user),
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
         user_id: int,
+        request: Request,
+        response: Response,
 ) -> Any:
     """
     Get a specific user by id.
     """
-    user = crud.user.get(db, id=user_id)
-    if user == current_user:
-        return user
-    if not crud.user.is_superuser(current_user):
+    if user_id != current_user.id and not crud.user.is_superuser(current_user):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="The user doesn't have enough privileges"
         )
-    return user
+    cached = await response_cache.lookup_async(
+        "read_user_by_id", request, principal=current_user.id,
+        tags=[crud.user.cache_tag(user_id), crud.user.cache_tag(current_user.id)]
+    )
+    if (hit := cached.response()) is not None:
+        return hit
+    user = current_user if user_id == current_user.id else await db.run(crud.user.get, id=user_id)
+    if not user:
+        return user
+    return await cached.store_async(user_encoder.encode_one(user), response)
 
 
 # noinspection PyUnusedLocal
 @router.put("/{user_id}", response_model=schemas.User)
-def update_user(
-        db: Session = Depends(deps.get_db),
+async def update_user(
+        db: SessionRunner = Depends(deps.get_db),
         *,
-        current_user: models.User = Depends(deps.get_current_active_superuser),  # Necessary for credentials validation
+        current_user: schemas.UserInDB = Depends(deps.get_current_active_superuser),  # Necessary for credentials validation
         user_id: int,
         user_in: schemas.UserUpdate,
 ) -> Any:
     """
     Update a user. Only for superusers.
     """
-    user = crud.user.get(db, id=user_id)
+    user = await db.run(crud.user.get, id=user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="The user with this username does not exist in the system",
         )
-    user = crud.user.update(db, db_obj=user, obj_in=user_in)
+    hashed_password = await security.get_password_hash_async(user_in.password) if user_in.password else None
+    user = await db.run(crud.user.update, db_obj=user, obj_in=user_in, hashed_password=hashed_password)
     return user
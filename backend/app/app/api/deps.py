@@ -1,45 +1,91 @@
-from typing import Generator
+from typing import AsyncGenerator
 
 import jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import ValidationError
-from sqlalchemy.orm import Session
 
 from app import crud
-from app import models
-from app import schemas
+from app import models, schemas
 from app.core import security
 from app.core.config import settings
-from app.db.session import SessionLocal
+from app.crud.loader import Loader
+from app.db import replicas
+from app.db.runner import SessionRunner, session_runner
 
 reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"{settings.CURRENT_API_STR}/login/"
 )
 
 
-def get_db() -> Generator:
-    db = SessionLocal()
-    try:
+async def get_db() -> AsyncGenerator:
+    async with session_runner() as db:
         yield db
-    finally:
-        db.close()
 
 
-def get_current_user(
-        *,
-        db: Session = Depends(get_db),
-        token: str = Depends(reusable_oauth2)
-) -> models.User:
+async def get_read_db(request: Request) -> AsyncGenerator:
+    """
+    Session for read-only endpoints, bound to a healthy replica unless the client has written recently
+    """
+    replica = None
+    if replicas.PIN_TO_PRIMARY_COOKIE not in request.cookies:
+        replica = replicas.replica_set.choose()
+    async with session_runner(replica) as db:
+        yield db
+
+
+async def get_threaded_db() -> AsyncGenerator:
+    """
+    Session using psycopg2 in both modes, for COPY which asyncpg sessions don't support
+    """
+    async with session_runner(threaded=True) as db:
+        yield db
+
+
+async def get_item_loader(db: SessionRunner = Depends(get_read_db)) -> Loader[models.Item]:
+    return Loader(crud.item, db)
+
+
+async def get_user_loader(db: SessionRunner = Depends(get_read_db)) -> Loader[models.User]:
+    return Loader(crud.user, db)
+
+
+def get_requested_ids(
+        ids: str | None = Query(None, regex=r"^\d+(,\d+)*$", description="Comma separated ids, e.g. 1,2,3")
+) -> list[int] | None:
+    """
+    Unique ids of the multi-get mode of list endpoints in request order, None if the mode is not requested
+    """
+    if ids is None:
+        return None
+    unique_ids = list(dict.fromkeys(int(value) for value in ids.split(",")))
+    if len(unique_ids) > settings.MULTI_GET_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.MULTI_GET_MAX_SIZE} ids per request"
+        )
+    return unique_ids
+
+
+def get_token_data(token: str = Depends(reusable_oauth2)) -> schemas.AccessTokenPayload:
     try:
-        payload = security.jwt_decode(token)
-        token_data = schemas.AccessTokenPayload(**payload)
+        return security.decode_access_token(token)
     except (jwt.PyJWTError, ValidationError):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
-    user = crud.user.get(db, id=token_data.sub)
+
+
+async def get_current_user(
+        *,
+        db: SessionRunner = Depends(get_db),
+        token_data: schemas.AccessTokenPayload = Depends(get_token_data)
+) -> schemas.UserInDB:
+    # cached snapshots are served without a trip to the session's thread or greenlet
+    user = crud.user.cache.get(token_data.sub)
+    if user is None:
+        user = await db.run(crud.user.get_cached, id=token_data.sub)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -48,9 +94,9 @@ def get_current_user(
     return user
 
 
-def get_current_active_user(
-        current_user: models.User = Depends(get_current_user),
-) -> models.User:
+async def get_current_active_user(
+        current_user: schemas.UserInDB = Depends(get_current_user),
+) -> schemas.UserInDB:
     if not crud.user.is_active(current_user):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -59,9 +105,9 @@ def get_current_active_user(
     return current_user
 
 
-def get_current_active_superuser(
-        current_user: models.User = Depends(get_current_user),
-) -> models.User:
+async def get_current_active_superuser(
+        current_user: schemas.UserInDB = Depends(get_current_user),
+) -> schemas.UserInDB:
     if not crud.user.is_superuser(current_user):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -0,0 +1,254 @@
+import argparse
+import logging
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Any, Callable
+
+from sqlalchemy import event, text
+
+from app import crud, models, schemas
+from app.core import security
+from app.core.config import settings
+from app.core.hashing import token_digest
+from app.db.session import SessionLocal, engine
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# refresh tokens are JWTs of 216 characters, all starting with the same header and payload prefix
+TOKEN_PREFIX = "eyJ0eXAiOiJKV1QiLCJhbGciOiJIUzI1NiJ9.eyJleHAiOj"
+TOKEN_LENGTH = 216
+
+
+def summary(timings: list[float]) -> dict[str, float]:
+    """
+    Mean and percentiles of `timings` in microseconds
+    """
+    quantiles = statistics.quantiles(timings, n=100)
+    return {
+        "mean_us": statistics.fmean(timings) * 1e6,
+        "p50_us": quantiles[49] * 1e6,
+        "p99_us": quantiles[98] * 1e6,
+    }
+
+
+def per_call_us(run: Callable[[], Any], *, calls: int, repeats: int = 5) -> float:
+    """
+    Median over `repeats` rounds of microseconds per call of `run`, called `calls` times a round
+    """
+    run()
+    rounds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in range(calls):
+            run()
+        rounds.append((time.perf_counter() - started) / calls * 1e6)
+    return statistics.median(rounds)
+
+
+def access_token_decode(args: argparse.Namespace) -> None:
+    """
+    Throughput of access token decoding, with and without the cache of verified payloads
+    """
+    token = security.create_access_token(1)
+
+    def cache_miss() -> None:
+        security.access_token_cache.clear()
+        security.decode_access_token(token)
+
+    cases = {
+        "uncached": lambda: schemas.AccessTokenPayload(**security.jwt_decode(token)),
+        "cache miss": cache_miss,
+        "cache hit": lambda: security.decode_access_token(token),
+    }
+    print(f"{'decode':12} {'us/call':>8} {'calls/s':>9}")
+    for name, run in cases.items():
+        us = per_call_us(run, calls=args.calls)
+        print(f"{name:12} {us:8.2f} {1e6 / us:9.0f}")
+
+
+@contextmanager
+def cursor_seconds():
+    """
+    Yields a list holding the seconds spent in cursor executions of `engine` so far, the time of the driver
+    and the database that is subtracted from calls to get the overhead of the Python side
+    """
+    spent = [0.0]
+
+    def before(conn, cursor, statement, parameters, context, executemany) -> None:
+        context.benchmark_started = time.perf_counter()
+
+    def after(conn, cursor, statement, parameters, context, executemany) -> None:
+        spent[0] += time.perf_counter() - context.benchmark_started
+
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "after_cursor_execute", after)
+    try:
+        yield spent
+    finally:
+        event.remove(engine, "before_cursor_execute", before)
+        event.remove(engine, "after_cursor_execute", after)
+
+
+def crud_lookups(args: argparse.Namespace) -> None:
+    """
+    Python overhead per call of hot CRUD lookups, compared with the legacy queries they replaced.
+    Looks up the first superuser and a refresh session created for it, which is deleted afterwards.
+    """
+    User, RefreshSession = models.User, models.RefreshSession
+    db = SessionLocal()
+    try:
+        user = crud.user.get_by_email(db, email=settings.FIRST_SUPERUSER)
+        if user is None:
+            raise SystemExit(f"First superuser {settings.FIRST_SUPERUSER} doesn't exist, run app/initial_data.py")
+        token = security.create_refresh_token(user.id)
+        crud.refresh_session.upsert(db, obj_in=schemas.RefreshSessionCreate(
+            refresh_token=token, expires_delta=timedelta(hours=1), user_id=user.id, fingerprint="benchmark"
+        ))
+        user_id, email = user.id, user.email
+
+        cases = {
+            "CRUDBase.get": (
+                lambda: crud.user.get(db, id=user_id),
+                lambda: db.query(User).filter(User.id == user_id).first(),
+            ),
+            "CRUDUser.get_by_email": (
+                lambda: crud.user.get_by_email(db, email=email),
+                lambda: db.query(User).filter(User.email == email).first(),
+            ),
+            "CRUDRefreshSession.get_by_token": (
+                lambda: crud.refresh_session.get_by_token(db, token=token),
+                lambda: db.query(RefreshSession).filter(
+                    RefreshSession.refresh_token_hash == token_digest(token)
+                ).first(),
+            ),
+            "CRUDRefreshSession.get_active": (
+                lambda: crud.refresh_session.get_active(db, user_id=user_id, fingerprint="benchmark"),
+                lambda: db.query(RefreshSession).filter(
+                    RefreshSession.user_id == user_id, RefreshSession.fingerprint == "benchmark"
+                ).first(),
+            ),
+        }
+        print(f"{'lookup':32} {'total us':>9} {'legacy':>8} {'python us':>10} {'legacy':>8}")
+        for name, runs in cases.items():
+            totals, overheads = [], []
+            for run in runs:
+                with cursor_seconds() as spent:
+                    total = per_call_us(run, calls=args.calls, repeats=1)
+                    in_cursor = spent[0] / (args.calls + 1) * 1e6
+                totals.append(total)
+                overheads.append(total - in_cursor)
+            print(f"{name:32} {totals[0]:9.1f} {totals[1]:8.1f} {overheads[0]:10.1f} {overheads[1]:8.1f}")
+        refresh_session = crud.refresh_session.get_active(db, user_id=user_id, fingerprint="benchmark")
+        crud.refresh_session.remove(db, id=refresh_session.id)
+    finally:
+        db.close()
+
+
+def refresh_token_index(args: argparse.Namespace) -> None:
+    """
+    Size and lookup latency of a unique index of refresh tokens compared with one of their 32 byte digests.
+    The tables are created in the database of the settings and dropped afterwards.
+    """
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            logger.info("Inserting %d tokens", args.rows)
+            connection.execute(text("CREATE UNLOGGED TABLE bench_refresh_token (token varchar NOT NULL)"))
+            connection.execute(text("CREATE UNLOGGED TABLE bench_refresh_token_digest (digest bytea NOT NULL)"))
+            # sha256 stands in for the HMAC of the application, the digest has the same size and distribution
+            connection.execute(
+                text(
+                    "INSERT INTO bench_refresh_token SELECT :prefix || left(translate(encode("
+                    "sha256((g || 'a')::bytea) || sha256((g || 'b')::bytea) || "
+                    "sha256((g || 'c')::bytea) || sha256((g || 'd')::bytea), 'base64'), E'+/=\\n', '-_'), :tail) "
+                    "FROM generate_series(1, :rows) g"
+                ),
+                {"prefix": TOKEN_PREFIX, "tail": TOKEN_LENGTH - len(TOKEN_PREFIX), "rows": args.rows}
+            )
+            connection.execute(
+                text("INSERT INTO bench_refresh_token_digest SELECT sha256(token::bytea) FROM bench_refresh_token")
+            )
+            for table, column in (("bench_refresh_token", "token"), ("bench_refresh_token_digest", "digest")):
+                logger.info("Indexing %s", table)
+                started = time.perf_counter()
+                connection.execute(text(f"CREATE UNIQUE INDEX ix_{table} ON {table} ({column})"))
+                build_seconds = time.perf_counter() - started
+                connection.execute(text(f"VACUUM ANALYZE {table}"))
+                sizes = connection.execute(
+                    text(f"SELECT pg_relation_size('{table}'), pg_relation_size('ix_{table}')")
+                ).one()
+                logger.info(
+                    "%s: table %d MB, index %d MB built in %.1fs",
+                    table, sizes[0] // 2 ** 20, sizes[1] // 2 ** 20, build_seconds
+                )
+
+            samples = connection.execute(
+                text(
+                    "SELECT token, sha256(token::bytea) FROM bench_refresh_token "
+                    "TABLESAMPLE BERNOULLI (1) REPEATABLE (0) LIMIT :lookups"
+                ),
+                {"lookups": args.lookups}
+            ).all()
+            random.Random(0).shuffle(samples)
+            by_token = text("SELECT 1 FROM bench_refresh_token WHERE token = :value")
+            by_digest = text("SELECT 1 FROM bench_refresh_token_digest WHERE digest = :value")
+
+            def execution_us(statement, value) -> float:
+                # time spent by the server alone, without the round trip of the lookup
+                explain = text(f"EXPLAIN (ANALYZE, FORMAT JSON) {statement.text}")
+                return connection.execute(explain, {"value": value}).scalar()[0]["Execution Time"] * 1000
+
+            for _ in range(2):
+                # the first round reads the indexes into the cache, lookups of both keys take turns
+                # so that noise of the machine affects both alike
+                timings = {"token": [], "digest": []}
+                server_us = {"token": [], "digest": []}
+                for token, digest in samples:
+                    for key, statement, value in (("token", by_token, token), ("digest", by_digest, bytes(digest))):
+                        started = time.perf_counter()
+                        connection.execute(statement, {"value": value}).one()
+                        timings[key].append(time.perf_counter() - started)
+                        server_us[key].append(execution_us(statement, value))
+            results = {
+                key: {**summary(timings[key]), "server_us": statistics.fmean(server_us[key])} for key in timings
+            }
+        finally:
+            connection.execute(text("DROP TABLE IF EXISTS bench_refresh_token, bench_refresh_token_digest"))
+
+    print(f"{'key':8} {'mean us':>8} {'p50 us':>8} {'p99 us':>8} {'server us':>10}")
+    for key, result in results.items():
+        print(
+            f"{key:8} {result['mean_us']:8.0f} {result['p50_us']:8.0f} {result['p99_us']:8.0f} "
+            f"{result['server_us']:10.1f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Microbenchmarks of single operations, those reading the database use the one of the settings"
+    )
+    commands = parser.add_subparsers(required=True)
+
+    command = commands.add_parser("access-token-decode", help=access_token_decode.__doc__.strip())
+    command.add_argument("--calls", type=int, default=20_000)
+    command.set_defaults(run=access_token_decode)
+
+    command = commands.add_parser("crud-lookups", help=crud_lookups.__doc__.split(".")[0].strip())
+    command.add_argument("--calls", type=int, default=5_000)
+    command.set_defaults(run=crud_lookups)
+
+    command = commands.add_parser("refresh-token-index", help=refresh_token_index.__doc__.split(".")[0].strip())
+    command.add_argument("--rows", type=int, default=10_000_000)
+    command.add_argument("--lookups", type=int, default=10_000)
+    command.set_defaults(run=refresh_token_index)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import hashlib
+import re
+from datetime import datetime, timedelta
+from typing import Any, Sequence
+
+from fastapi import Response
+from starlette import status
+
+EPOCH = datetime(1970, 1, 1)
+ENTITY_TAG = re.compile(r'(?:W/)?"([^"]*)"')
+
+
+def _microseconds(value: datetime) -> int:
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def row_tag(updated_at: datetime) -> str:
+    """
+    Weak ETag of an object, its `updated_at` changes with every update
+    """
+    return f'W/"{_microseconds(updated_at)}"'
+
+
+def page_tag(rows: Sequence[Any], *, total: int | None = None) -> str:
+    """
+    Weak ETag of a page of objects or rows having `id` and `updated_at`: number of rows and their latest update.
+    A digest of the ids is added, as a row leaving the page and another one taking its place may keep both,
+    and `total` when the number of all rows is sent with the page
+    """
+    latest = max((row.updated_at for row in rows), default=EPOCH)
+    digest = hashlib.blake2b(b"".join(row.id.to_bytes(8, "big", signed=True) for row in rows), digest_size=8)
+    tag = f"{len(rows)}-{_microseconds(latest)}-{digest.hexdigest()}"
+    if total is not None:
+        tag += f"-{total}"
+    return f'W/"{tag}"'
+
+
+def matches(header: str | None, tag: str) -> bool:
+    """
+    Whether `If-None-Match` or `If-Match` `header` lists `tag` or is `*`. Tags are compared weakly,
+    so the weak ETags of the API can be used in `If-Match` as well
+    """
+    if header is None:
+        return False
+    if header.strip() == "*":
+        return True
+    return ENTITY_TAG.fullmatch(tag).group(1) in ENTITY_TAG.findall(header)
+
+
+def versions(header: str) -> list[datetime] | None:
+    """
+    `updated_at` values of the row tags listed by `If-Match` `header`, None for `*`.
+    Tags not made by `row_tag()` can't match any object and are skipped
+    """
+    if header.strip() == "*":
+        return None
+    return [
+        EPOCH + timedelta(microseconds=int(opaque))
+        for opaque in ENTITY_TAG.findall(header)
+        if opaque.isdigit() and len(opaque) <= 17
+    ]
+
+
+def not_modified(tag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": tag})
@@ -0,0 +1,138 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, AsyncIterable, AsyncIterator, Sequence
+
+from sqlalchemy import Column
+from sqlalchemy.types import TypeEngine
+
+from app.schemas.export import ExportFormat
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+
+class ExportFormatUnavailable(RuntimeError):
+    """
+    Raised when a library required by the export format is not installed
+    """
+
+
+class RowEncoder:
+    media_type: str
+    extension: str
+
+    def __init__(self, columns: Sequence[str]):
+        """
+        Serializes batches of rows to chunks of a streamed response body, so the whole export
+        is never held in memory.
+
+        **Parameters**
+
+        * `columns`: Names of the row fields in order
+        """
+        self.columns = list(columns)
+
+    def header(self) -> bytes:
+        return b""
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        raise NotImplementedError
+
+    def footer(self) -> bytes:
+        return b""
+
+
+class NDJSONEncoder(RowEncoder):
+    media_type = "application/x-ndjson"
+    extension = "ndjson"
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        return "".join(
+            json.dumps(dict(zip(self.columns, row)), default=str) + "\n" for row in rows
+        ).encode()
+
+
+class CSVEncoder(RowEncoder):
+    media_type = "text/csv"
+    extension = "csv"
+
+    def _write(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+
+    def header(self) -> bytes:
+        return self._write([self.columns])
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        return self._write(rows)
+
+
+class ArrowEncoder(RowEncoder):
+    media_type = "application/vnd.apache.arrow.stream"
+    extension = "arrows"
+
+    def __init__(self, columns: Sequence[str], schema: "pa.Schema"):
+        super().__init__(columns)
+        self.schema = schema
+        self._sink = io.BytesIO()
+        self._writer = pa.ipc.new_stream(self._sink, schema)
+
+    def _flush(self) -> bytes:
+        chunk = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return chunk
+
+    def header(self) -> bytes:
+        return self._flush()
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        self._writer.write_batch(pa.RecordBatch.from_pylist(
+            [dict(zip(self.columns, row)) for row in rows], schema=self.schema
+        ))
+        return self._flush()
+
+    def footer(self) -> bytes:
+        self._writer.close()
+        return self._flush()
+
+
+def arrow_type(sa_type: TypeEngine) -> "pa.DataType":
+    for python_type, arrow_alias in (
+        (bool, "bool"), (int, "int64"), (float, "double"), (datetime, "timestamp[us]"), (bytes, "binary")
+    ):
+        try:
+            if issubclass(sa_type.python_type, python_type):
+                return pa.type_for_alias(arrow_alias)
+        except NotImplementedError:
+            break
+    return pa.string()
+
+
+def get_encoder(export_format: ExportFormat, columns: Sequence[Column]) -> RowEncoder:
+    if export_format is ExportFormat.ndjson:
+        return NDJSONEncoder([column.name for column in columns])
+    if export_format is ExportFormat.csv:
+        return CSVEncoder([column.name for column in columns])
+    if pa is None:
+        raise ExportFormatUnavailable("Arrow export requires pyarrow, install it with `poetry install -E export`")
+    return ArrowEncoder(
+        [column.name for column in columns],
+        pa.schema([(column.name, arrow_type(column.type)) for column in columns])
+    )
+
+
+async def encode_stream_async(
+        encoder: RowEncoder,
+        batches: AsyncIterable[Sequence[Sequence[Any]]]
+) -> AsyncIterator[bytes]:
+    yield encoder.header()
+    async for rows in batches:
+        yield encoder.encode(rows)
+    yield encoder.footer()
@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import hmac
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable
+
+from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def token_digest(token: str) -> bytes:
+    """
+    Fixed-size keyed digest of a token, so tokens can be looked up without being stored
+    """
+    return hmac.new(settings.SECRET_KEY.encode(), token.encode(), hashlib.sha256).digest()
+
+
+class PasswordHashingUnavailable(RuntimeError):
+    """
+    Raised when the hashing pool queue is full or a job did not finish in time
+    """
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    def __init__(self, *, workers: int, queue_size: int, timeout: float):
+        """
+        Runs bcrypt in a pool of worker processes, so hashing neither holds the GIL
+        of the API process nor occupies the shared threadpool while it waits.
+
+        **Parameters**
+
+        * `workers`: Number of worker processes, `0` hashes inline in the calling thread or the threadpool
+        * `queue_size`: How many jobs may wait for a free worker before new ones are rejected
+        * `timeout`: Seconds to wait for a job before giving up
+        """
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_size) if workers else None
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # forked workers would inherit sockets of open client connections, keeping them open
+                    # after the server closes them, so workers are started as fresh interpreters
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+        return self._executor
+
+    def _submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHashingUnavailable("Password hashing queue is full")
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if not self.workers:
+            return fn(*args)
+        future = self._submit(fn, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise PasswordHashingUnavailable("Password hashing timed out")
+
+    async def _run_async(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if not self.workers:
+            # inline hashing of sync callers happens in threadpool workers too, not in the event loop
+            return await run_in_threadpool(fn, *args)
+        future = self._submit(fn, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise PasswordHashingUnavailable("Password hashing timed out")
+
+    def hash(self, password: str) -> str:
+        return self._run(_hash, password)
+
+    def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return self._run(_verify, plain_password, hashed_password)
+
+    async def hash_async(self, password: str) -> str:
+        return await self._run_async(_hash, password)
+
+    async def verify_async(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run_async(_verify, plain_password, hashed_password)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+hasher = PasswordHasher(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    queue_size=settings.PASSWORD_HASH_QUEUE_SIZE,
+    timeout=settings.PASSWORD_HASH_TIMEOUT_SECONDS,
+)
@@ -0,0 +1,101 @@
+import codecs
+import csv
+import json
+import time
+from typing import Any, BinaryIO, Iterable, Iterator
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from app import crud, schemas
+from app.core.config import settings
+
+
+class InvalidImportFile(ValueError):
+    """
+    Raised when the uploaded file can't be read at all, unlike invalid rows, which are only rejected
+    """
+
+
+def read_ndjson(file: BinaryIO) -> Iterator[tuple[int, Any]]:
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as e:
+            yield line_number, e
+
+
+def read_csv(file: BinaryIO) -> Iterator[tuple[int, Any]]:
+    reader = csv.DictReader(codecs.iterdecode(file, "utf-8"))
+    try:
+        if reader.fieldnames is None or "title" not in reader.fieldnames:
+            raise InvalidImportFile("CSV header must contain title column")
+        for row in reader:
+            # empty cells are missing values, not empty strings
+            yield reader.line_num, {key: value for key, value in row.items() if value != "" and key is not None}
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise InvalidImportFile(f"Line {reader.line_num}: {e}")
+
+
+readers = {
+    schemas.ImportFormat.ndjson: read_ndjson,
+    schemas.ImportFormat.csv: read_csv,
+}
+
+
+def validate_chunks(
+        rows: Iterable[tuple[int, Any]],
+        report: schemas.ItemImportReport,
+        *,
+        chunk_size: int,
+        max_rejections: int
+) -> Iterator[list[schemas.ItemCreate]]:
+    """
+    Validate rows against `schemas.ItemCreate` and group valid ones in chunks of `chunk_size`.
+    Invalid rows are counted in `report`, first `max_rejections` of them are described there
+    """
+    chunk = []
+    for line_number, row in rows:
+        report.rows_read += 1
+        try:
+            if isinstance(row, Exception):
+                raise row
+            if not isinstance(row, dict):
+                raise ValueError("Row must be an object")
+            chunk.append(schemas.ItemCreate(**row))
+        except (ValidationError, ValueError) as e:
+            report.rows_rejected += 1
+            if len(report.rejections) < max_rejections:
+                report.rejections.append(schemas.ItemImportRejection(line=line_number, detail=str(e)))
+            continue
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_items(
+        db: Session,
+        file: BinaryIO,
+        *,
+        import_format: schemas.ImportFormat,
+        owner_id: int,
+        chunk_size: int = settings.ITEMS_IMPORT_CHUNK_SIZE,
+        max_rejections: int = settings.ITEMS_IMPORT_MAX_REPORTED_REJECTIONS
+) -> schemas.ItemImportReport:
+    """
+    Create items owned by `owner_id` from NDJSON or CSV `file` in one transaction, invalid rows are skipped
+    """
+    report = schemas.ItemImportReport()
+    started = time.perf_counter()
+    chunks = validate_chunks(
+        readers[import_format](file), report, chunk_size=chunk_size, max_rejections=max_rejections
+    )
+    report.rows_imported = crud.item.copy_with_owner(db, chunks=chunks, owner_id=owner_id)
+    report.seconds = time.perf_counter() - started
+    if report.seconds:
+        report.rows_per_second = report.rows_imported / report.seconds
+    return report
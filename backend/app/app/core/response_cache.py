@@ -0,0 +1,355 @@
+import hashlib
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Sequence
+
+from fastapi import Request, Response
+from starlette.concurrency import run_in_threadpool
+
+from app.core import etag
+from app.core.config import settings
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# tags invalidated in the current context are collected here instead, see `ResponseCache.deferred_invalidation()`
+_deferred_tags: ContextVar[list[str] | None] = ContextVar("deferred_tags", default=None)
+
+
+class ResponseCacheUnavailable(RuntimeError):
+    """
+    Raised when the library required by the configured response cache backend is not installed
+    """
+
+
+class CacheBackend:
+    """
+    Byte store of the response cache, a small subset of Redis commands
+    """
+    # whether calls wait for IO, async endpoints run them in the threadpool then
+    blocking = False
+
+    def get_many(self, keys: Sequence[str]) -> list[bytes | None]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, *, ttl: float) -> None:
+        raise NotImplementedError
+
+    def add(self, key: str, value: bytes, *, ttl: float) -> bool:
+        """
+        Set `key` only if it doesn't exist, returns whether it was set
+        """
+        raise NotImplementedError
+
+    def set_many(self, values: dict[str, bytes], *, ttl: float) -> None:
+        raise NotImplementedError
+
+    def delete(self, keys: Sequence[str]) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> dict[str, Any]:
+        return {}
+
+
+class MemoryCacheBackend(CacheBackend):
+    # bookkeeping of an entry besides its key and value, roughly
+    ENTRY_OVERHEAD = 100
+
+    def __init__(self, *, max_bytes: int):
+        """
+        Thread-safe in-process LRU store whose entries expire after their ttl.
+
+        **Parameters**
+
+        * `max_bytes`: Approximate limit of the size of keys and values, least recently used entries
+          are evicted above it, `0` disables the store
+        """
+        self.max_bytes = max_bytes
+        self._bytes = 0
+        self._data: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Sequence[str]) -> list[bytes | None]:
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is not None and entry[0] <= now:
+                    self._pop(key)
+                    entry = None
+                if entry is not None:
+                    self._data.move_to_end(key)
+                values.append(None if entry is None else entry[1])
+        return values
+
+    def set(self, key: str, value: bytes, *, ttl: float) -> None:
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def add(self, key: str, value: bytes, *, ttl: float) -> bool:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return False
+            self._set(key, value, ttl)
+            return True
+
+    def set_many(self, values: dict[str, bytes], *, ttl: float) -> None:
+        with self._lock:
+            for key, value in values.items():
+                self._set(key, value, ttl)
+
+    def delete(self, keys: Sequence[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._pop(key)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._data), "bytes": self._bytes}
+
+    def _set(self, key: str, value: bytes, ttl: float) -> None:
+        self._pop(key)
+        size = self._size(key, value)
+        if size > self.max_bytes:
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            self._pop(next(iter(self._data)))
+
+    def _pop(self, key: str) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= self._size(key, entry[1])
+
+    def _size(self, key: str, value: bytes) -> int:
+        return len(key) + len(value) + self.ENTRY_OVERHEAD
+
+
+class RedisCacheBackend(CacheBackend):
+    blocking = True
+
+    def __init__(self, *, url: str):
+        """
+        Store shared by all processes in a server speaking the Redis protocol.
+
+        **Parameters**
+
+        * `url`: Server URL, e.g. `redis://localhost:6379/0`
+        """
+        if redis is None:
+            raise ResponseCacheUnavailable("Redis response cache requires redis package")
+        self.client = redis.Redis.from_url(url)
+
+    def get_many(self, keys: Sequence[str]) -> list[bytes | None]:
+        return self.client.mget(keys)
+
+    def set(self, key: str, value: bytes, *, ttl: float) -> None:
+        self.client.set(key, value, px=max(int(ttl * 1000), 1))
+
+    def add(self, key: str, value: bytes, *, ttl: float) -> bool:
+        return bool(self.client.set(key, value, px=max(int(ttl * 1000), 1), nx=True))
+
+    def set_many(self, values: dict[str, bytes], *, ttl: float) -> None:
+        pipeline = self.client.pipeline(transaction=False)
+        for key, value in values.items():
+            pipeline.set(key, value, px=max(int(ttl * 1000), 1))
+        pipeline.execute()
+
+    def delete(self, keys: Sequence[str]) -> None:
+        if keys:
+            self.client.delete(*keys)
+
+
+class CacheLookup:
+    def __init__(
+            self,
+            cache: "ResponseCache",
+            *,
+            route: str,
+            key: str | None,
+            tokens: list[str],
+            entry: bytes | None
+    ):
+        """
+        Result of `ResponseCache.lookup()`: the cached response if it's still valid,
+        and what's needed to store the response otherwise
+        """
+        self.cache = cache
+        self.route = route
+        self.key = key
+        self.tokens = tokens
+        self.headers: list[tuple[str, str]] = []
+        self.body: bytes | None = None
+        if entry is not None:
+            meta, body = entry.split(b"\n", 1)
+            stored_tokens, headers = json.loads(meta)
+            if stored_tokens == tokens:
+                self.headers = [tuple(header) for header in headers]
+                self.body = body
+
+    def response(self, if_none_match: str | None = None) -> Response | None:
+        """
+        Cached response, or 304 if it has an `ETag` listed by `if_none_match`. None on a miss
+        """
+        if self.body is None:
+            return None
+        tag = next((value for name, value in self.headers if name == "etag"), None)
+        if tag is not None and etag.matches(if_none_match, tag):
+            return etag.not_modified(tag)
+        return Response(self.body, media_type="application/json", headers=dict(self.headers))
+
+    def store(self, body: bytes, response: Response) -> Response:
+        """
+        Response of JSON `body` with headers set on the `response` parameter of the endpoint.
+        It's cached with the tag tokens read by the lookup, so it's a miss if a tag was invalidated meanwhile
+        """
+        headers = [(name, value) for name, value in response.headers.items() if name != "content-length"]
+        if self.key is not None:
+            meta = json.dumps([self.tokens, headers]).encode()
+            self.cache.backend.set(self.key, meta + b"\n" + body, ttl=self.cache.ttls[self.route])
+        encoded = Response(body, media_type="application/json")
+        encoded.raw_headers.extend(response.raw_headers)
+        return encoded
+
+    async def store_async(self, body: bytes, response: Response) -> Response:
+        if self.key is not None and self.cache.backend.blocking:
+            return await run_in_threadpool(self.store, body, response)
+        return self.store(body, response)
+
+
+class ResponseCache:
+    def __init__(self, backend: CacheBackend, *, ttls: dict[str, float], settle: float = 0):
+        """
+        Cache of encoded responses of read endpoints, keyed by route, principal and query parameters.
+
+        Every entry has tags naming the rows it was read from. A tag has a random token in the backend,
+        which is stored with the entry, and invalidating the tag replaces the token: entries holding
+        the old one are misses from then on. Tokens are read before the endpoint reads the database,
+        so a response read while its rows are being changed is never served after the change.
+
+        **Parameters**
+
+        * `backend`: Store of entries and tag tokens
+        * `ttls`: Lifetime of entries in seconds by route, routes not listed or with `0` are not cached
+        * `settle`: Seconds after invalidation of a tag during which its responses are not cached,
+          e.g. while read replicas may still return the old rows
+        """
+        self.backend = backend
+        self.ttls = {route: ttl for route, ttl in ttls.items() if ttl > 0}
+        self.settle = settle
+        # tokens outlive entries, a token expiring earlier only turns its entries into misses
+        self.tag_ttl = 2 * max(self.ttls.values(), default=0)
+        self._counts: dict[str, list[int]] = {route: [0, 0] for route in self.ttls}
+        self._lock = threading.Lock()
+
+    def lookup(self, route: str, request: Request, *, principal: Any, tags: Sequence[str]) -> CacheLookup:
+        """
+        Look up the response of `route` to `request` made by `principal`, e.g. the id of the current user.
+        `tags` of the response must be known before reading it
+        """
+        if route not in self.ttls:
+            return CacheLookup(self, route=route, key=None, tokens=[], entry=None)
+        query = sorted(request.query_params.multi_items())
+        digest = hashlib.blake2b(f"{request.url.path}?{query}".encode(), digest_size=16).hexdigest()
+        key = f"response:{route}:{principal}:{digest}"
+        tag_keys = [f"tag:{tag}" for tag in dict.fromkeys(tags)]
+        entry, *tokens = self.backend.get_many([key, *tag_keys])
+        for i, token in enumerate(tokens):
+            if token is None:
+                token = self._token(settled_at=0)
+                if not self.backend.add(tag_keys[i], token, ttl=self.tag_ttl):
+                    # created by a concurrent lookup, a token expiring right away only makes a miss
+                    token = self.backend.get_many([tag_keys[i]])[0] or token
+                tokens[i] = token
+        tokens = [token.decode() for token in tokens]
+        now = time.time()
+        settled = all(float(token.partition(":")[2]) <= now for token in tokens)
+        lookup = CacheLookup(self, route=route, key=key if settled else None, tokens=tokens, entry=entry)
+        with self._lock:
+            counts = self._counts[route]
+            if lookup.body is None:
+                counts[1] += 1
+            else:
+                counts[0] += 1
+        return lookup
+
+    async def lookup_async(
+            self,
+            route: str,
+            request: Request,
+            *,
+            principal: Any,
+            tags: Sequence[str]
+    ) -> CacheLookup:
+        if route in self.ttls and self.backend.blocking:
+            return await run_in_threadpool(self.lookup, route, request, principal=principal, tags=tags)
+        return self.lookup(route, request, principal=principal, tags=tags)
+
+    def invalidate(self, *tags: str) -> None:
+        """
+        Make entries tagged with any of `tags` misses
+        """
+        if not self.ttls or not tags:
+            return
+        deferred = _deferred_tags.get()
+        if deferred is not None:
+            deferred.extend(tags)
+            return
+        keys = [f"tag:{tag}" for tag in tags]
+        if not self.settle:
+            self.backend.delete(keys)
+            return
+        token = self._token(settled_at=time.time() + self.settle)
+        self.backend.set_many(dict.fromkeys(keys, token), ttl=self.tag_ttl)
+
+    @contextmanager
+    def deferred_invalidation(self, tags: list[str]) -> Iterator[None]:
+        """
+        Within the block, `invalidate()` calls of this context append their tags to `tags` instead,
+        so the caller can invalidate them after leaving the event loop, e.g. if the backend is blocking
+        """
+        token = _deferred_tags.set(tags)
+        try:
+            yield
+        finally:
+            _deferred_tags.reset(token)
+
+    @staticmethod
+    def _token(*, settled_at: float) -> bytes:
+        # wall clock time, as tokens may be shared by processes on several hosts
+        return f"{secrets.token_hex(8)}:{settled_at:.3f}".encode()
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Hits and misses of this process by route, with the size of the backend if it's known
+        """
+        with self._lock:
+            routes = {
+                route: {"hits": hits, "misses": misses, "hit_ratio": hits / (hits + misses) if hits + misses else 0.0}
+                for route, (hits, misses) in self._counts.items()
+            }
+        return {"routes": routes, **self.backend.stats()}
+
+
+def get_backend() -> CacheBackend:
+    if settings.RESPONSE_CACHE_BACKEND == "redis":
+        return RedisCacheBackend(url=settings.RESPONSE_CACHE_REDIS_URL)
+    return MemoryCacheBackend(max_bytes=settings.RESPONSE_CACHE_MAX_BYTES)
+
+
+response_cache = ResponseCache(
+    get_backend(),
+    ttls=settings.RESPONSE_CACHE_TTL_SECONDS,
+    # responses read from replicas until the writer would be pinned to the primary aren't cached
+    settle=settings.READ_YOUR_WRITES_SECONDS if settings.SQLALCHEMY_REPLICA_URIS else 0
+)
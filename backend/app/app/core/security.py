@@ -1,19 +1,23 @@
+import hashlib
+import secrets
+import time
 from datetime import datetime, timedelta
 from typing import Any
 
 import jwt
-from fastapi import Depends
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
 
-from app import crud, schemas
-from app.api import deps
+from app import schemas
+from app.core.cache import TTLCache
 from app.core.config import settings
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.core.hashing import hasher, pwd_context  # noqa
 
 ALGORITHM = "HS256"
 
+# Validated access token payloads keyed by token digest, together with token expiration timestamp
+access_token_cache: TTLCache[tuple[float, schemas.AccessTokenPayload]] = TTLCache(
+    maxsize=settings.ACCESS_TOKEN_CACHE_SIZE, ttl=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+)
+
 
 def create_access_token(
         subject: str | Any,
@@ -48,30 +52,18 @@ def create_refresh_token(
         expire = now + timedelta(
             minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES
         )
-    payload = {"exp": expire, "sub": str(subject), "grant_type": "refresh", **extra_payload}
+    # jti makes every refresh token unique, even if two are issued for the same subject in the same second
+    payload = {
+        "exp": expire,
+        "sub": str(subject),
+        "grant_type": "refresh",
+        "jti": secrets.token_urlsafe(16),
+        **extra_payload
+    }
     encoded_jwt = jwt_encode(payload)
     return encoded_jwt
 
 
-def write_new_refresh_session(
-        db: Session = Depends(deps.get_db),
-        *,
-        refresh_token,
-        user_id,
-        fingerprint,
-        refresh_expire_delta=timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES),
-) -> None:
-    refresh_session = schemas.RefreshSessionCreate(
-        refresh_token=refresh_token,
-        expires_delta=refresh_expire_delta,
-        user_id=user_id,
-        fingerprint=fingerprint
-    )
-    crud.refresh_session.create(
-        db, obj_in=refresh_session
-    )
-
-
 def create_jwt_pair(
         subject: str | Any,
         fingerprint: str
@@ -92,9 +84,37 @@ def jwt_decode(subject: str) -> dict[str, Any]:
     return jwt.decode(subject, settings.SECRET_KEY, algorithms=[ALGORITHM])
 
 
+def decode_access_token(token: str) -> schemas.AccessTokenPayload:
+    """
+    Verify access token and validate its payload.
+    Results are cached until the token expires, so replayed tokens skip signature and payload validation
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    cached = access_token_cache.get(key)
+    if cached is not None:
+        expires_at, token_data = cached
+        if expires_at > time.time():
+            return token_data
+        access_token_cache.invalidate(key)
+    payload = jwt_decode(token)
+    token_data = schemas.AccessTokenPayload(**payload)
+    expires_at = payload.get("exp")
+    if expires_at is not None:
+        access_token_cache.set(key, (expires_at, token_data), ttl=expires_at - time.time())
+    return token_data
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return hasher.verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return hasher.hash(password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await hasher.verify_async(plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await hasher.hash_async(password)
@@ -0,0 +1,61 @@
+import json
+from typing import Any, Iterable
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON
+from pydantic.utils import lenient_issubclass
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# response class of the app, routes which return objects still validate them with their `response_model`
+DefaultResponse = ORJSONResponse if orjson is not None else JSONResponse
+
+
+class ORMEncoder:
+    def __init__(self, schema: type[BaseModel]):
+        """
+        Encodes ORM objects to the JSON `schema` with `orm_mode` would produce, without creating
+        a pydantic model and running `jsonable_encoder()` for every object. Attribute values are passed
+        to orjson as they are, so only schemas of plain fields are supported and values are not validated.
+        Without orjson they go through `jsonable_encoder()` and the json module.
+
+        **Parameters**
+
+        * `schema`: Response model of a single object, it stays the documented `response_model` of the route
+        """
+        fields = list(schema.__fields__.values())
+        for field in fields:
+            if field.shape != SHAPE_SINGLETON or lenient_issubclass(field.type_, BaseModel):
+                raise TypeError(f"Field {schema.__name__}.{field.name} can not be encoded by ORMEncoder")
+        self.schema = schema
+        self._fields = [(field.alias, field.name) for field in fields]
+
+    def encode(self, objs: Iterable[Any]) -> bytes:
+        fields = self._fields
+        return self._dumps([{alias: getattr(obj, name) for alias, name in fields} for obj in objs])
+
+    def encode_one(self, obj: Any) -> bytes:
+        return self._dumps({alias: getattr(obj, name) for alias, name in self._fields})
+
+    @staticmethod
+    def _dumps(value: Any) -> bytes:
+        if orjson is None:
+            return json.dumps(jsonable_encoder(value), separators=(",", ":")).encode()
+        return orjson.dumps(value)
+
+    def response(self, objs: list[Any], response: Response) -> Any:
+        """
+        Response of encoded `objs` with headers set on the `response` parameter of the endpoint.
+        Without orjson `objs` are returned as they are, to be serialized by the route
+        """
+        if orjson is None:
+            return objs
+        encoded = Response(self.encode(objs), media_type="application/json")
+        encoded.raw_headers.extend(response.raw_headers)
+        return encoded
@@ -1,9 +1,21 @@
-from typing import Any, Generic, Type, TypeVar
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Generic, Sequence, Type, TypeVar
 
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy import (
+    Column, Integer, any_, column, delete, insert, inspect, lambda_stmt, literal, select, true, tuple_, update, values
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Query, Session, aliased
+from sqlalchemy.sql import ColumnElement, Executable, Select
 
+from app.core.response_cache import response_cache
 from app.db.base_class import Base
 
 ModelType = TypeVar("ModelType", bound=Base)
@@ -11,7 +23,31 @@ CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
 UpdateSchemaType = TypeVar("UpdateSchemaType", bound=BaseModel)
 
 
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(*values: Any) -> str:
+    """
+    Opaque pagination cursor holding the sort key of the last row of a page
+    """
+    return base64.urlsafe_b64encode(json.dumps(jsonable_encoder(values)).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return values
+
+
 class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
+    # columns telling whether a page changed, all of them are in the keyset pagination indexes
+    version_columns = ["id", "created_at", "updated_at"]
+
     def __init__(self, model: Type[ModelType]):
         """
         CRUD object with default methods to Create, Read, Update, Delete (CRUD).
@@ -25,16 +61,65 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
 
     # noinspection PyShadowingBuiltins
     def get(self, db: Session, id: Any) -> ModelType | None:
-        return db.query(self.model).filter(self.model.id == id).first()
+        model = self.model
+        # lambda statements skip rebuilding the query and its cache key on every call
+        return db.execute(lambda_stmt(lambda: select(model).where(model.id == id))).scalars().first()
+
+    # noinspection PyShadowingBuiltins
+    def get_row(self, db: Session, id: Any, *, columns: Sequence[str]) -> Row | None:
+        """
+        Only `columns` of the object with given `id`, e.g. to check its version without loading it
+        """
+        return db.execute(
+            select(*(getattr(self.model, name) for name in columns)).where(self.model.id == id)
+        ).first()
 
     def get_multi(
             self,
             db: Session,
             *,
             offset: int = 0,
-            limit: int = 100
+            limit: int = 100,
+            cursor: str | None = None,
+            columns: Sequence[str] | None = None
+    ) -> list[ModelType]:
+        return self.paginate(db.query(self.model), offset=offset, limit=limit, cursor=cursor, columns=columns)
+
+    def paginate(
+            self,
+            query: Query,
+            *,
+            offset: int = 0,
+            limit: int = 100,
+            cursor: str | None = None,
+            columns: Sequence[str] | None = None
     ) -> list[ModelType]:
-        return db.query(self.model).offset(offset).limit(limit).all()
+        """
+        Page of `query` in stable `(created_at, id)` order.
+        With `cursor` from `next_cursor()` the page starts right after the last row of the previous one,
+        so deep pages cost as much as the first one, while `offset` has to skip all previous rows.
+        With `columns` rows of these columns are returned instead of objects, e.g. `version_columns`
+        """
+        query = query.order_by(self.model.created_at, self.model.id)
+        if columns is not None:
+            query = query.with_entities(*(getattr(self.model, name) for name in columns))
+        if cursor is not None:
+            try:
+                created_at, last_id = decode_cursor(cursor)
+                position = (datetime.fromisoformat(created_at), int(last_id))
+            except (TypeError, ValueError):
+                raise InvalidCursor(cursor)
+            query = query.filter(tuple_(self.model.created_at, self.model.id) > tuple_(*position))
+        return query.offset(offset).limit(limit).all()
+
+    @staticmethod
+    def next_cursor(page: list[ModelType], *, limit: int) -> str | None:
+        """
+        Cursor of the page following `page`, None if `page` is the last one
+        """
+        if not page or len(page) < limit:
+            return None
+        return encode_cursor(page[-1].created_at, page[-1].id)
 
     def create(
             self,
@@ -47,8 +132,59 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         db.add(db_obj)
         db.commit()
         db.refresh(db_obj)
+        self.changed([db_obj])
         return db_obj
 
+    def create_multi(
+            self,
+            db: Session,
+            *,
+            objs_in: list[CreateSchemaType | dict[str, Any]]
+    ) -> list[ModelType]:
+        """
+        Create objects with a single multi-row INSERT ... RETURNING. Databases without RETURNING,
+        e.g. SQLite standing in for shards in tests, need `id` in every row, the rows are read back by it
+        """
+        if not objs_in:
+            return []
+        rows = [obj_in if isinstance(obj_in, dict) else jsonable_encoder(obj_in) for obj_in in objs_in]
+        stmt = insert(self.model).values(rows)
+        if db.get_bind().dialect.full_returning:
+            db_objs = self._returning(db, stmt)
+        else:
+            db.execute(stmt)
+            inserted = db.query(self.model).filter(self.model.id.in_([row["id"] for row in rows]))
+            by_id = {db_obj.id: db_obj for db_obj in inserted}
+            db_objs = [by_id[row["id"]] for row in rows]
+            for db_obj in db_objs:
+                db.expunge(db_obj)
+        db.commit()
+        self.changed(db_objs)
+        return db_objs
+
+    def create_each(
+            self,
+            db: Session,
+            *,
+            objs_in: list[CreateSchemaType | dict[str, Any]]
+    ) -> list[ModelType | Exception]:
+        """
+        Create objects with `create_multi()`, but a failing row doesn't fail the others:
+        then rows are retried one by one and every failed row gets its exception instead of an object
+        """
+        try:
+            return self.create_multi(db, objs_in=objs_in)
+        except SQLAlchemyError:
+            db.rollback()
+        results: list[ModelType | Exception] = []
+        for obj_in in objs_in:
+            try:
+                results += self.create_multi(db, objs_in=[obj_in])
+            except SQLAlchemyError as e:
+                db.rollback()
+                results.append(e)
+        return results
+
     def update(
             self,
             db: Session,
@@ -67,6 +203,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         db.add(db_obj)
         db.commit()
         db.refresh(db_obj)
+        self.changed([db_obj])
         return db_obj
 
     # noinspection PyShadowingBuiltins
@@ -79,4 +216,183 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         obj = db.query(self.model).get(id)
         db.delete(obj)
         db.commit()
+        self.changed([obj])
         return obj
+
+    # noinspection PyShadowingBuiltins
+    def update_if(
+            self,
+            db: Session,
+            *,
+            id: Any,
+            obj_in: UpdateSchemaType | dict[str, Any],
+            condition: ColumnElement | None = None
+    ) -> tuple[bool, ModelType | None]:
+        """
+        Update the object with given `id` if it matches `condition` with a single UPDATE ... RETURNING.
+        Returns whether the object exists and the updated object, which is None if `condition` didn't match.
+        Without fields to update the object is only read, so its `updated_at` is kept
+        """
+        table = self.model.__table__
+        update_data = obj_in if isinstance(obj_in, dict) else obj_in.dict(exclude_unset=True)
+        update_data = {field: value for field, value in update_data.items() if field in table.c and field != "id"}
+        if not update_data:
+            return self._mutate_if(db, select(table), id=id, condition=condition)
+        return self._mutate_if(db, update(table).values(update_data), id=id, condition=condition)
+
+    # noinspection PyShadowingBuiltins
+    def remove_if(
+            self,
+            db: Session,
+            *,
+            id: Any,
+            condition: ColumnElement | None = None
+    ) -> tuple[bool, ModelType | None]:
+        """
+        Delete the object with given `id` if it matches `condition` with a single DELETE ... RETURNING.
+        Returns whether the object exists and the deleted object, which is None if `condition` didn't match
+        """
+        return self._mutate_if(db, delete(self.model.__table__), id=id, condition=condition)
+
+    # noinspection PyShadowingBuiltins
+    def _mutate_if(
+            self,
+            db: Session,
+            stmt: Any,
+            *,
+            id: Any,
+            condition: ColumnElement | None
+    ) -> tuple[bool, ModelType | None]:
+        # existence of the row is read in the same statement from a snapshot taken before the change,
+        # so not found and not matching `condition` are told apart without another round trip.
+        # A SELECT `stmt` only reads the matching row, which isn't reported as changed then
+        table = self.model.__table__
+        stmt = stmt.where(table.c.id == id)
+        if condition is not None:
+            stmt = stmt.where(condition)
+        mutates = not isinstance(stmt, Select)
+        if mutates:
+            changed = stmt.returning(*self._loaded_columns()).cte("changed")
+        else:
+            changed = stmt.with_only_columns(*self._loaded_columns()).cte("changed")
+        target = select(table.c.id).where(table.c.id == id).cte("target")
+        changed_obj = aliased(self.model, changed, adapt_on_names=True)
+        row = db.execute(
+            select(target.c.id, changed_obj)
+            .select_from(target)
+            .outerjoin(changed_obj, true())
+            .execution_options(populate_existing=True)
+        ).first()
+        db_obj = row[1] if row else None
+        if db_obj is not None:
+            db.expunge(db_obj)
+        db.commit()
+        if db_obj is not None and mutates:
+            self.changed([db_obj])
+        return row is not None, db_obj
+
+    def update_multi(
+            self,
+            db: Session,
+            *,
+            objs_in: list[dict[str, Any]]
+    ) -> list[ModelType]:
+        """
+        Update objects identified by `id` key of every dict of `objs_in` with UPDATE ... FROM (VALUES ...).
+        Objects updating the same set of fields share one statement, all of them are updated in one transaction
+        """
+        table = self.model.__table__
+        groups: dict[tuple[str, ...], list[dict[str, Any]]] = {}
+        for obj_in in objs_in:
+            fields = tuple(sorted(field for field in obj_in if field != "id" and field in table.c))
+            groups.setdefault(fields, []).append(obj_in)
+        db_objs = []
+        for fields, rows in groups.items():
+            if not fields:
+                db_objs += self.get_many(db, ids=[row["id"] for row in rows])
+                continue
+            data = values(
+                *(column(name, table.c[name].type) for name in ("id", *fields)), name="data"
+            ).data([tuple(row[name] for name in ("id", *fields)) for row in rows])
+            stmt = (
+                update(table)
+                .where(table.c.id == data.c.id)
+                .values({name: data.c[name] for name in fields})
+            )
+            db_objs += self._returning(db, stmt)
+        db.commit()
+        self.changed(db_objs)
+        return db_objs
+
+    def remove_multi(
+            self,
+            db: Session,
+            *,
+            ids: list[int]
+    ) -> list[ModelType]:
+        """
+        Delete objects with a single DELETE ... WHERE id = ANY(...) RETURNING
+        """
+        db_objs = self._returning(db, delete(self.model).where(self._id_in(ids)))
+        db.commit()
+        self.changed(db_objs)
+        return db_objs
+
+    def get_many(self, db: Session, *, ids: list[int]) -> list[ModelType]:
+        return db.query(self.model).filter(self._id_in(ids)).all()
+
+    def _id_in(self, ids: list[int]) -> Any:
+        # a single array parameter instead of IN with a parameter per id
+        return self.model.id == any_(literal(list(ids), ARRAY(Integer)))
+
+    def _returning(self, db: Session, stmt: Executable) -> list[ModelType]:
+        """
+        Execute INSERT, UPDATE or DELETE statement and load affected rows as objects of the model.
+        Objects are detached from the session, so they aren't expired and reloaded after commit
+        """
+        stmt = stmt.returning(*self._loaded_columns())
+        db_objs = (
+            db.execute(select(self.model).from_statement(stmt).execution_options(populate_existing=True))
+            .scalars()
+            .all()
+        )
+        for db_obj in db_objs:
+            db.expunge(db_obj)
+        return db_objs
+
+    def _loaded_columns(self) -> list[Column]:
+        """
+        Columns loaded with the objects, deferred ones are left out
+        """
+        return [
+            attr.columns[0] for attr in inspect(self.model).column_attrs if not attr.deferred
+        ]
+
+    # noinspection PyShadowingBuiltins
+    def invalidate(self, id: Any) -> None:
+        """
+        Called after the object with given `id` was changed or removed, override to drop cached copies of it
+        """
+        pass
+
+    # noinspection PyShadowingBuiltins
+    def cache_tag(self, id: Any) -> str:
+        """
+        Response cache tag of responses holding the object with given `id`
+        """
+        return f"{self.model.__tablename__}:{id}"
+
+    def cache_tags(self, db_objs: list[ModelType]) -> list[str]:
+        """
+        Response cache tags invalidated when `db_objs` change, override to add tags of responses depending on them
+        """
+        return [self.cache_tag(db_obj.id) for db_obj in db_objs]
+
+    def changed(self, db_objs: list[ModelType]) -> None:
+        """
+        Called after `db_objs` were created, changed or removed.
+        Calls `invalidate()` for every object and invalidates their `cache_tags()`
+        """
+        for db_obj in db_objs:
+            self.invalidate(db_obj.id)
+        response_cache.invalidate(*self.cache_tags(db_objs))
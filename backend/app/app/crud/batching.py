@@ -0,0 +1,95 @@
+import asyncio
+import copy
+from typing import Any, Awaitable, Callable, Generic, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def waiter_error(error: Exception) -> Exception:
+    """
+    Exception of one value of a batch whose flush raised `error`. Every waiter gets its own copy
+    chained to `error`, as raising the same object in several tasks mixes up their tracebacks
+    """
+    try:
+        copied = copy.copy(error)
+    except Exception:
+        copied = RuntimeError(f"Batched write failed: {error!r}")
+    copied.__cause__ = error
+    return copied
+
+
+def _retrieve(future: asyncio.Future) -> None:
+    if not future.cancelled():
+        future.exception()
+
+
+class _Batch:
+    def __init__(self):
+        self.pending: list[tuple[Any, asyncio.Future]] = []
+        self.full = asyncio.Event()
+
+
+class WriteBatcher(Generic[T, R]):
+    def __init__(
+            self,
+            flush: Callable[[list[T]], Awaitable[list[R | Exception]]],
+            *,
+            max_size: int,
+            max_wait: float
+    ):
+        """
+        Coalesces values submitted by concurrent requests, so they are written with one `flush()` call.
+        A batch is flushed by a task of its own after `max_wait` seconds or when `max_size` values are submitted.
+        Values of cancelled requests are still written with their batch, their results are dropped.
+
+        **Parameters**
+
+        * `flush`: Writes values, returns a result or an exception for each value in the same order
+        * `max_size`: Largest number of values in a batch
+        * `max_wait`: Longest time the first value of a batch waits for others, in seconds
+        """
+        self.flush = flush
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._current: _Batch | None = None
+        self._flushes: set[asyncio.Task] = set()
+
+    async def submit(self, value: T) -> R:
+        """
+        Result of `value` in a flushed batch, its exception is raised only in the submitting task
+        """
+        future = asyncio.get_running_loop().create_future()
+        batch = self._current
+        if batch is None:
+            batch = self._current = _Batch()
+            task = asyncio.create_task(self._run(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+        batch.pending.append((value, future))
+        if len(batch.pending) >= self.max_size:
+            self._current = None
+            batch.full.set()
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # cancelling the caller leaves `future` to the batch, its exception mustn't be reported as never retrieved
+            future.add_done_callback(_retrieve)
+            raise
+
+    async def _run(self, batch: _Batch) -> None:
+        try:
+            await asyncio.wait_for(batch.full.wait(), self.max_wait)
+        except asyncio.TimeoutError:
+            pass
+        if self._current is batch:
+            self._current = None
+        try:
+            results = await self.flush([value for value, _ in batch.pending])
+        except Exception as e:
+            results = [waiter_error(e) for _ in batch.pending]
+        for (_, future), result in zip(batch.pending, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -1,12 +1,46 @@
+import heapq
+import io
+import itertools
+import threading
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from typing import Any, Callable, Iterable, Iterator, Sequence, TypeVar
+
 from fastapi.encoders import jsonable_encoder
+from sqlalchemy import (
+    Column, Integer, and_, cast, column, func, insert, literal, literal_column, select, table, text, tuple_
+)
+from sqlalchemy.dialects.postgresql import ARRAY, DOUBLE_PRECISION
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
+from sqlalchemy.sql import ColumnElement, Select
+from sqlalchemy.sql.expression import Grouping
 
-from app.crud.base import CRUDBase
+from app.core.response_cache import response_cache
+from app.crud.base import CRUDBase, InvalidCursor, decode_cursor, encode_cursor
+from app.db.session import ShardRouter, item_shards
 from app.models.item import Item
+from app.models.item_owner_stats import ItemOwnerStats
 from app.schemas.item import ItemCreate, ItemUpdate
 
+T = TypeVar("T")
+
+
+def copy_text_line(*values: str | None) -> str:
+    """
+    Line of COPY text format, None is NULL
+    """
+    return "\t".join(
+        "\\N" if value is None else
+        value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+        for value in values
+    ) + "\n"
+
 
 class CRUDItem(CRUDBase[Item, ItemCreate, ItemUpdate]):
+    # fields of schemas.Item
+    export_columns: list[Column] = [Item.__table__.c[name] for name in ("id", "title", "description", "owner_id")]
+
     def create_with_owner(
             self,
             db: Session,
@@ -20,24 +54,584 @@ class CRUDItem(CRUDBase[Item, ItemCreate, ItemUpdate]):
         db.add(db_obj)
         db.commit()
         db.refresh(db_obj)
+        self.changed([db_obj])
         return db_obj
 
-    # noinspection PyPep8
-    def get_multi_by_owner(
+    def create_multi_with_owner(
             self,
             db: Session,
             *,
+            objs_in: list[ItemCreate],
+            owner_id: int
+    ) -> list[Item]:
+        return self.create_multi(
+            db, objs_in=[{**jsonable_encoder(obj_in), "owner_id": owner_id} for obj_in in objs_in]
+        )
+
+    def copy_with_owner(
+            self,
+            db: Session,
+            *,
+            chunks: Iterable[list[ItemCreate]],
             owner_id: int,
+            allocate_ids: Callable[[int], list[int]] | None = None
+    ) -> int:
+        """
+        Create items from `chunks` in one transaction. Every chunk is sent to a temporary staging table
+        with COPY FROM STDIN, then all rows are moved to the item table with a single INSERT ... SELECT.
+        Ids of the items are taken from `allocate_ids(number of rows)` if given, from the item id sequence otherwise.
+        Returns number of created items
+        """
+        connection = db.connection()
+        connection.execute(text(
+            "CREATE TEMPORARY TABLE item_import (title varchar NOT NULL, description varchar) ON COMMIT DROP"
+        ))
+        staging = table("item_import", column("title"), column("description"))
+        # COPY isn't available through SQLAlchemy, so it goes to the psycopg2 cursor directly
+        cursor = connection.connection.cursor()
+        try:
+            for chunk in chunks:
+                buffer = io.StringIO()
+                buffer.writelines(copy_text_line(obj_in.title, obj_in.description) for obj_in in chunk)
+                buffer.seek(0)
+                cursor.copy_expert("COPY item_import (title, description) FROM STDIN", buffer)
+        finally:
+            cursor.close()
+        now = datetime.utcnow()
+        columns = ["title", "description", "owner_id", "created_at", "updated_at"]
+        values = [staging.c.title, staging.c.description, literal(owner_id), literal(now), literal(now)]
+        if allocate_ids is not None:
+            ids = allocate_ids(connection.execute(select(func.count()).select_from(staging)).scalar())
+            # n-th staged row gets n-th id
+            columns.append("id")
+            values.append(Grouping(literal(ids, ARRAY(Integer)))[func.row_number().over()])
+        result = connection.execute(insert(Item).from_select(columns, select(*values)))
+        db.commit()
+        response_cache.invalidate(self.pages_tag(), self.pages_tag(owner_id))
+        return result.rowcount
+
+    # noinspection PyShadowingBuiltins
+    def update_by_owner(
+            self,
+            db: Session,
+            *,
+            id: int,
+            obj_in: ItemUpdate | dict[str, Any],
+            owner_id: int | None,
+            condition: ColumnElement | None = None
+    ) -> tuple[bool, Item | None]:
+        """
+        Update item if it belongs to `owner_id`, None allows any owner, and it matches `condition`.
+        See `CRUDBase.update_if()`
+        """
+        owned_by = self._owned_by(owner_id)
+        if owned_by is not None:
+            condition = owned_by if condition is None else and_(owned_by, condition)
+        return self.update_if(db, id=id, obj_in=obj_in, condition=condition)
+
+    # noinspection PyShadowingBuiltins
+    def remove_by_owner(
+            self,
+            db: Session,
+            *,
+            id: int,
+            owner_id: int | None
+    ) -> tuple[bool, Item | None]:
+        """
+        Delete item if it belongs to `owner_id`, None allows any owner. See `CRUDBase.remove_if()`
+        """
+        return self.remove_if(db, id=id, condition=self._owned_by(owner_id))
+
+    @staticmethod
+    def _owned_by(owner_id: int | None) -> Any:
+        return None if owner_id is None else Item.owner_id == owner_id
+
+    @staticmethod
+    def pages_tag(owner_id: int | None = None) -> str:
+        """
+        Response cache tag of pages of all items, or of the items of `owner_id`
+        """
+        return "item:pages" if owner_id is None else f"item:pages:{owner_id}"
+
+    def cache_tags(self, db_objs: list[Item]) -> list[str]:
+        if not db_objs:
+            return []
+        owner_tags = {self.pages_tag(db_obj.owner_id) for db_obj in db_objs}
+        return [*super().cache_tags(db_objs), self.pages_tag(), *owner_tags]
+
+    def search(
+            self,
+            db: Session,
+            *,
+            q: str,
+            owner_id: int | None = None,
+            offset: int = 0,
+            limit: int = 100,
+            cursor: str | None = None
+    ) -> list[tuple[Item, float]]:
+        """
+        Items matching web search style query `q` with their rank, best matches first.
+        Pass `search_cursor()` of a page as `cursor` to get the next one
+        """
+        # same text search configuration as in Item.search_vector, untyped literal so it's cast to regconfig
+        query = func.websearch_to_tsquery(literal_column("'english'"), q)
+        # real is printed rounded, double precision round-trips through the cursor exactly
+        rank = cast(func.ts_rank(Item.search_vector, query), DOUBLE_PRECISION)
+        stmt = select(Item, rank).where(Item.search_vector.op("@@")(query))
+        if owner_id is not None:
+            stmt = stmt.where(Item.owner_id == owner_id)
+        if cursor is not None:
+            try:
+                last_rank, last_id = decode_cursor(cursor)
+                position = (float(last_rank), int(last_id))
+            except (TypeError, ValueError):
+                raise InvalidCursor(cursor)
+            stmt = stmt.where(tuple_(rank, Item.id) < tuple_(*position))
+        stmt = stmt.order_by(rank.desc(), Item.id.desc()).offset(offset).limit(limit)
+        return db.execute(stmt).all()
+
+    @staticmethod
+    def search_cursor(page: list[tuple[Item, float]], *, limit: int) -> str | None:
+        if not page or len(page) < limit:
+            return None
+        last_item, last_rank = page[-1]
+        return encode_cursor(last_rank, last_item.id)
+
+    def count(
+            self,
+            db: Session,
+            *,
+            owner_id: int | None = None,
+            exact: bool = True
+    ) -> tuple[int, bool]:
+        """
+        Number of items of `owner_id`, or of all items if it's None, read from per-owner counters.
+        Unless `exact`, the number of all items is the planner estimate, which costs the same for any number of owners.
+        Returns the number and whether it's an estimate
+        """
+        if owner_id is not None:
+            stmt = select(ItemOwnerStats.item_count).where(ItemOwnerStats.owner_id == owner_id)
+            return db.execute(stmt).scalar() or 0, False
+        if not exact:
+            # summed over partitions, the partitioned table itself has no rows.
+            # reltuples is -1 until a table is vacuumed or analyzed for the first time
+            estimate = db.execute(
+                text(
+                    "SELECT CASE WHEN min(reltuples) >= 0 THEN sum(reltuples)::bigint END "
+                    "FROM pg_partition_tree(CAST(:table AS regclass)) AS tree JOIN pg_class ON oid = tree.relid "
+                    "WHERE tree.isleaf"
+                ),
+                {"table": self.model.__tablename__}
+            ).scalar()
+            if estimate is not None:
+                return estimate, True
+        return db.execute(select(func.coalesce(func.sum(ItemOwnerStats.item_count), 0))).scalar(), False
+
+    def owner_counts(
+            self,
+            db: Session,
+            *,
             offset: int = 0,
             limit: int = 100
+    ) -> list[ItemOwnerStats]:
+        """
+        Owners with most items first
+        """
+        stmt = (
+            select(ItemOwnerStats)
+            .order_by(ItemOwnerStats.item_count.desc(), ItemOwnerStats.owner_id)
+            .offset(offset)
+            .limit(limit)
+        )
+        return db.execute(stmt).scalars().all()
+
+    def get_multi_by_owner(
+            self,
+            db: Session,
+            *,
+            owner_id: int,
+            offset: int = 0,
+            limit: int = 100,
+            cursor: str | None = None,
+            columns: Sequence[str] | None = None
+    ) -> list[Item]:
+        return self.paginate(
+            db.query(self.model).filter(Item.owner_id == owner_id),
+            offset=offset,
+            limit=limit,
+            cursor=cursor,
+            columns=columns
+        )
+
+    def export_statement(self, *, owner_id: int | None = None) -> Select:
+        stmt = select(*self.export_columns).order_by(Item.id)
+        if owner_id is not None:
+            stmt = stmt.where(Item.owner_id == owner_id)
+        return stmt
+
+    def stream(
+            self,
+            db: Session,
+            *,
+            owner_id: int | None = None,
+            batch_size: int = 1000,
+            idle_timeout: float | None = None
+    ) -> Iterator[list[Row]]:
+        """
+        Plain rows of `export_columns` in batches of `batch_size`, read through a server-side cursor,
+        so memory use doesn't depend on the number of rows. `idle_timeout` replaces
+        idle_in_transaction_session_timeout of the server for the transaction of the cursor,
+        which is idle while the consumer of a batch is slower than the database
+        """
+        if idle_timeout is not None and db.get_bind().dialect.name == "postgresql":
+            db.execute(select(func.set_config(
+                "idle_in_transaction_session_timeout", f"{int(idle_timeout * 1000)}ms", True
+            )))
+        stmt = self.export_statement(owner_id=owner_id).execution_options(
+            stream_results=True, max_row_buffer=batch_size
+        )
+        yield from db.execute(stmt).partitions(batch_size)
+
+
+class ShardedCRUDItem(CRUDItem):
+    def __init__(self, model: type[Item], shards: ShardRouter):
+        """
+        CRUDItem storing items in shards picked by owner id. Operations of a single owner go to one shard,
+        others are sent to every shard and their results are merged in the order of the unsharded query.
+        Changes spanning several shards are committed per shard, not atomically.
+        Ids are allocated from the item id sequence of the session passed to writes, so they stay unique.
+
+        **Parameters**
+
+        * `model`: Item model
+        * `shards`: Router of shard sessions
+        """
+        super().__init__(model)
+        self.shards = shards
+        # does the actual work on a shard session
+        self.local = CRUDItem(model)
+        # next id given out by `_allocate_ids()` without a sequence
+        self._next_id: int | None = None
+        self._ids_lock = threading.Lock()
+
+    @contextmanager
+    def _shard(self, db: Session, name: str) -> Iterator[Session]:
+        shard_db = self.shards.session(name, like=db)
+        try:
+            yield shard_db
+        finally:
+            shard_db.close()
+
+    def _on_owner(self, db: Session, owner_id: int, method: Callable[..., T], **kwargs: Any) -> T:
+        with self._shard(db, self.shards.shard_for(owner_id)) as shard_db:
+            return method(shard_db, owner_id=owner_id, **kwargs)
+
+    def _on_all(self, db: Session, method: Callable[..., T], **kwargs: Any) -> list[T]:
+        results = []
+        for name in self.shards.names:
+            with self._shard(db, name) as shard_db:
+                results.append(method(shard_db, **kwargs))
+        return results
+
+    def _until_found(
+            self,
+            db: Session,
+            method: Callable[..., tuple[bool, Item | None]],
+            **kwargs: Any
+    ) -> tuple[bool, Item | None]:
+        # the shard of `owner_id` most likely holds the item, others are asked to tell 404 from 403
+        names = self.shards.names
+        if kwargs.get("owner_id") is not None:
+            first = self.shards.shard_for(kwargs["owner_id"])
+            names = [first] + [name for name in names if name != first]
+        for name in names:
+            with self._shard(db, name) as shard_db:
+                found, db_obj = method(shard_db, **kwargs)
+            if found:
+                return found, db_obj
+        return False, None
+
+    def _allocate_ids(self, db: Session, count: int) -> list[int]:
+        if db.get_bind().dialect.supports_sequences:
+            stmt = select(func.nextval(literal_column("'item_id_seq'"))).select_from(func.generate_series(1, count))
+            return db.execute(stmt).scalars().all()
+        # databases without sequences, e.g. SQLite standing in for shards in tests, continue after the largest id
+        # of all shards, ids are unique within this process only
+        with self._ids_lock:
+            if self._next_id is None:
+                self._next_id = max(self._on_all(db, self._max_id)) + 1
+            first, self._next_id = self._next_id, self._next_id + count
+        return list(range(first, first + count))
+
+    @staticmethod
+    def _max_id(db: Session) -> int:
+        return db.execute(select(func.max(Item.id))).scalar() or 0
+
+    # noinspection PyShadowingBuiltins
+    def get(self, db: Session, id: Any) -> Item | None:
+        for name in self.shards.names:
+            with self._shard(db, name) as shard_db:
+                db_obj = self.local.get(shard_db, id=id)
+            if db_obj is not None:
+                return db_obj
+        return None
+
+    # noinspection PyShadowingBuiltins
+    def get_row(self, db: Session, id: Any, *, columns: Sequence[str]) -> Row | None:
+        for name in self.shards.names:
+            with self._shard(db, name) as shard_db:
+                row = self.local.get_row(shard_db, id=id, columns=columns)
+            if row is not None:
+                return row
+        return None
+
+    def get_many(self, db: Session, *, ids: list[int]) -> list[Item]:
+        return list(itertools.chain.from_iterable(self._on_all(db, self.local.get_many, ids=ids)))
+
+    def get_multi(
+            self,
+            db: Session,
+            *,
+            offset: int = 0,
+            limit: int = 100,
+            cursor: str | None = None,
+            columns: Sequence[str] | None = None
+    ) -> list[Item]:
+        # every shard returns enough rows for the page, the merge is ordered by the cursor key,
+        # so `columns` must include created_at and id
+        pages = self._on_all(
+            db, self.local.get_multi, offset=0, limit=offset + limit, cursor=cursor, columns=columns
+        )
+        merged = heapq.merge(*pages, key=lambda db_obj: (db_obj.created_at, db_obj.id))
+        return list(itertools.islice(merged, offset, offset + limit))
+
+    def get_multi_by_owner(
+            self,
+            db: Session,
+            *,
+            owner_id: int,
+            offset: int = 0,
+            limit: int = 100,
+            cursor: str | None = None,
+            columns: Sequence[str] | None = None
     ) -> list[Item]:
-        return (
-            db.query(self.model)
-                .filter(Item.owner_id == owner_id)
-                .offset(offset)
-                .limit(limit)
-                .all()
+        return self._on_owner(
+            db, owner_id, self.local.get_multi_by_owner, offset=offset, limit=limit, cursor=cursor, columns=columns
+        )
+
+    def create(self, db: Session, *, obj_in: ItemCreate | dict[str, Any]) -> Item:
+        """
+        Create an item in the shard of its owner, so `obj_in` must have `owner_id`
+        """
+        row = obj_in if isinstance(obj_in, dict) else jsonable_encoder(obj_in)
+        if row.get("owner_id") is None:
+            raise TypeError("Sharded items need an owner, use create_with_owner()")
+        return self.create_multi(db, objs_in=[row])[0]
+
+    def create_multi(
+            self,
+            db: Session,
+            *,
+            objs_in: list[ItemCreate | dict[str, Any]]
+    ) -> list[Item]:
+        return self._create_by_shard(db, self.local.create_multi, objs_in=objs_in)
+
+    def create_each(
+            self,
+            db: Session,
+            *,
+            objs_in: list[ItemCreate | dict[str, Any]]
+    ) -> list[Item | Exception]:
+        # rows are retried within their shard, so rows committed by another shard are not created twice
+        return self._create_by_shard(db, self.local.create_each, objs_in=objs_in)
+
+    def _create_by_shard(
+            self,
+            db: Session,
+            method: Callable[..., list[T]],
+            *,
+            objs_in: list[ItemCreate | dict[str, Any]]
+    ) -> list[T]:
+        rows = [obj_in if isinstance(obj_in, dict) else jsonable_encoder(obj_in) for obj_in in objs_in]
+        ids = iter(self._allocate_ids(db, sum("id" not in row for row in rows)))
+        rows = [row if "id" in row else {**row, "id": next(ids)} for row in rows]
+        by_shard: dict[str, list[dict[str, Any]]] = {}
+        for row in rows:
+            by_shard.setdefault(self.shards.shard_for(row["owner_id"]), []).append(row)
+        results = {}
+        for name, shard_rows in by_shard.items():
+            with self._shard(db, name) as shard_db:
+                shard_results = method(shard_db, objs_in=shard_rows)
+            results.update((row["id"], result) for row, result in zip(shard_rows, shard_results))
+        return [results[row["id"]] for row in rows]
+
+    def create_with_owner(
+            self,
+            db: Session,
+            *,
+            obj_in: ItemCreate,
+            owner_id: int
+    ) -> Item:
+        return self.create_multi_with_owner(db, objs_in=[obj_in], owner_id=owner_id)[0]
+
+    def copy_with_owner(
+            self,
+            db: Session,
+            *,
+            chunks: Iterable[list[ItemCreate]],
+            owner_id: int,
+            allocate_ids: Callable[[int], list[int]] | None = None
+    ) -> int:
+        return self._on_owner(
+            db, owner_id, self.local.copy_with_owner,
+            chunks=chunks, allocate_ids=allocate_ids or (lambda count: self._allocate_ids(db, count))
+        )
+
+    def update(
+            self,
+            db: Session,
+            *,
+            db_obj: Item,
+            obj_in: ItemUpdate | dict[str, Any]
+    ) -> Item:
+        with self._shard(db, self.shards.shard_for(db_obj.owner_id)) as shard_db:
+            return self.local.update(shard_db, db_obj=db_obj, obj_in=obj_in)
+
+    # noinspection PyShadowingBuiltins
+    def remove(self, db: Session, *, id: int) -> Item:
+        return self.remove_if(db, id=id)[1]
+
+    # noinspection PyShadowingBuiltins
+    def update_if(
+            self,
+            db: Session,
+            *,
+            id: Any,
+            obj_in: ItemUpdate | dict[str, Any],
+            condition: Any = None
+    ) -> tuple[bool, Item | None]:
+        return self._until_found(db, self.local.update_if, id=id, obj_in=obj_in, condition=condition)
+
+    # noinspection PyShadowingBuiltins
+    def remove_if(
+            self,
+            db: Session,
+            *,
+            id: Any,
+            condition: Any = None
+    ) -> tuple[bool, Item | None]:
+        return self._until_found(db, self.local.remove_if, id=id, condition=condition)
+
+    # noinspection PyShadowingBuiltins
+    def update_by_owner(
+            self,
+            db: Session,
+            *,
+            id: int,
+            obj_in: ItemUpdate | dict[str, Any],
+            owner_id: int | None,
+            condition: ColumnElement | None = None
+    ) -> tuple[bool, Item | None]:
+        return self._until_found(
+            db, self.local.update_by_owner, id=id, obj_in=obj_in, owner_id=owner_id, condition=condition
         )
 
+    # noinspection PyShadowingBuiltins
+    def remove_by_owner(
+            self,
+            db: Session,
+            *,
+            id: int,
+            owner_id: int | None
+    ) -> tuple[bool, Item | None]:
+        return self._until_found(db, self.local.remove_by_owner, id=id, owner_id=owner_id)
+
+    def update_multi(
+            self,
+            db: Session,
+            *,
+            objs_in: list[dict[str, Any]]
+    ) -> list[Item]:
+        return list(itertools.chain.from_iterable(self._on_all(db, self.local.update_multi, objs_in=objs_in)))
+
+    def remove_multi(
+            self,
+            db: Session,
+            *,
+            ids: list[int]
+    ) -> list[Item]:
+        return list(itertools.chain.from_iterable(self._on_all(db, self.local.remove_multi, ids=ids)))
+
+    def search(
+            self,
+            db: Session,
+            *,
+            q: str,
+            owner_id: int | None = None,
+            offset: int = 0,
+            limit: int = 100,
+            cursor: str | None = None
+    ) -> list[tuple[Item, float]]:
+        if owner_id is not None:
+            return self._on_owner(
+                db, owner_id, self.local.search, q=q, offset=offset, limit=limit, cursor=cursor
+            )
+        pages = self._on_all(db, self.local.search, q=q, offset=0, limit=offset + limit, cursor=cursor)
+        merged = heapq.merge(*pages, key=lambda result: (-result[1], -result[0].id))
+        return list(itertools.islice(merged, offset, offset + limit))
+
+    def count(
+            self,
+            db: Session,
+            *,
+            owner_id: int | None = None,
+            exact: bool = True
+    ) -> tuple[int, bool]:
+        if owner_id is not None:
+            return self._on_owner(db, owner_id, self.local.count, exact=exact)
+        counts = self._on_all(db, self.local.count, exact=exact)
+        return sum(total for total, _ in counts), any(estimated for _, estimated in counts)
+
+    def owner_counts(
+            self,
+            db: Session,
+            *,
+            offset: int = 0,
+            limit: int = 100
+    ) -> list[ItemOwnerStats]:
+        pages = self._on_all(db, self.local.owner_counts, offset=0, limit=offset + limit)
+        merged = heapq.merge(*pages, key=lambda stats: (-stats.item_count, stats.owner_id))
+        return list(itertools.islice(merged, offset, offset + limit))
+
+    def stream(
+            self,
+            db: Session,
+            *,
+            owner_id: int | None = None,
+            batch_size: int = 1000,
+            idle_timeout: float | None = None
+    ) -> Iterator[list[Row]]:
+        if owner_id is not None:
+            with self._shard(db, self.shards.shard_for(owner_id)) as shard_db:
+                yield from self.local.stream(
+                    shard_db, owner_id=owner_id, batch_size=batch_size, idle_timeout=idle_timeout
+                )
+            return
+        # shard streams are merged by id, like the unsharded export is ordered
+        with ExitStack() as stack:
+            rows = heapq.merge(
+                *(
+                    itertools.chain.from_iterable(
+                        self.local.stream(
+                            stack.enter_context(self._shard(db, name)), batch_size=batch_size, idle_timeout=idle_timeout
+                        )
+                    )
+                    for name in self.shards.names
+                ),
+                key=lambda row: row.id
+            )
+            while batch := list(itertools.islice(rows, batch_size)):
+                yield batch
+
 
-item = CRUDItem(Item)
+item = ShardedCRUDItem(Item, item_shards) if item_shards else CRUDItem(Item)
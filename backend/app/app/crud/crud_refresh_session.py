@@ -1,7 +1,10 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
+from sqlalchemy import any_, delete, func, insert, lambda_stmt, literal, select
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import Session
 
+from app.core.hashing import token_digest
 from app.crud.base import CRUDBase
 from app.models.refresh_session import RefreshSession
 from app.schemas.refresh_session import RefreshSessionCreate, RefreshSessionsUpdate
@@ -10,7 +13,10 @@ from app.schemas.refresh_session import RefreshSessionCreate, RefreshSessionsUpd
 class CRUDRefreshSession(CRUDBase[RefreshSession, RefreshSessionCreate, RefreshSessionsUpdate]):
     @staticmethod
     def get_by_token(db: Session, *, token: str) -> RefreshSession | None:
-        return db.query(RefreshSession).filter(RefreshSession.refresh_token == token).first()
+        digest = token_digest(token)
+        return db.execute(
+            lambda_stmt(lambda: select(RefreshSession).where(RefreshSession.refresh_token_hash == digest))
+        ).scalars().first()
 
     @staticmethod
     def get_active(
@@ -19,18 +25,18 @@ class CRUDRefreshSession(CRUDBase[RefreshSession, RefreshSessionCreate, RefreshS
             user_id: int,
             fingerprint: str
     ) -> RefreshSession | None:
-        return (
-            db.query(RefreshSession).filter(
+        return db.execute(lambda_stmt(
+            lambda: select(RefreshSession).where(
                 RefreshSession.user_id == user_id,
                 RefreshSession.fingerprint == fingerprint
-            ).first()
-        )
+            )
+        )).scalars().first()
 
     def create(self, db: Session, *, obj_in: RefreshSessionCreate) -> RefreshSession:
         # noinspection PyArgumentList
         db_obj = RefreshSession(
             user_id=obj_in.user_id,
-            refresh_token=obj_in.refresh_token,
+            refresh_token_hash=token_digest(obj_in.refresh_token),
             fingerprint=obj_in.fingerprint,
             expires_in=datetime.utcnow() + obj_in.expires_delta,
         )
@@ -39,9 +45,96 @@ class CRUDRefreshSession(CRUDBase[RefreshSession, RefreshSessionCreate, RefreshS
         db.refresh(db_obj)
         return db_obj
 
+    @staticmethod
+    def upsert(db: Session, *, obj_in: RefreshSessionCreate) -> None:
+        """
+        Create session with `obj_in.user_id` and `obj_in.fingerprint` or replace the token of existing one in one statement
+        """
+        now = datetime.utcnow()
+        stmt = postgresql.insert(RefreshSession).values(
+            user_id=obj_in.user_id,
+            refresh_token_hash=token_digest(obj_in.refresh_token),
+            fingerprint=obj_in.fingerprint,
+            created_at=now,
+            expires_in=now + obj_in.expires_delta,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[RefreshSession.user_id, RefreshSession.fingerprint],
+            set_={
+                field: stmt.excluded[field]
+                for field in ("refresh_token_hash", "created_at", "expires_in")
+            },
+        )
+        db.execute(stmt)
+        db.commit()
+
+    @staticmethod
+    def remove_expired(db: Session, *, limit: int, now: datetime | None = None) -> int:
+        """
+        Delete up to `limit` sessions expired before `now`, rows locked by other transactions are skipped.
+        Returns number of deleted sessions
+        """
+        expired = (
+            select(RefreshSession.id)
+            .where(RefreshSession.expires_in < (now or datetime.utcnow()))
+            .order_by(RefreshSession.expires_in)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .cte("expired")
+        )
+        # an array of the ids is compared by primary key lookups, `IN (subquery)` may be planned
+        # as a semi join reading the whole table for every batch
+        result = db.execute(
+            delete(RefreshSession)
+            .where(RefreshSession.id == any_(func.array(select(expired.c.id).scalar_subquery())))
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return result.rowcount
+
     def remove_by_token(self, db: Session, *, token: str) -> RefreshSession | None:
         obj = self.get_by_token(db, token=token)
         return self.remove(db, id=obj.id)
 
+    @staticmethod
+    def rotate(
+            db: Session,
+            *,
+            token: str,
+            fingerprint: str,
+            new_token: str,
+            expires_delta: timedelta
+    ) -> int | None:
+        """
+        Atomically replace the session of `token` with a session of `new_token` in one statement.
+        The old session is removed even if `fingerprint` doesn't match, so a stolen token can't be used twice.
+        Returns user id of the new session, None if token is unknown, already rotated or fingerprint doesn't match
+        """
+        now = datetime.utcnow()
+        old = (
+            delete(RefreshSession)
+            .where(RefreshSession.refresh_token_hash == token_digest(token))
+            .returning(RefreshSession.user_id, RefreshSession.fingerprint)
+            .cte("old")
+        )
+        new = (
+            select(
+                old.c.user_id,
+                literal(token_digest(new_token)),
+                old.c.fingerprint,
+                literal(now),
+                literal(now + expires_delta)
+            )
+            .where(old.c.fingerprint == fingerprint)
+        )
+        stmt = (
+            insert(RefreshSession)
+            .from_select(["user_id", "refresh_token_hash", "fingerprint", "created_at", "expires_in"], new)
+            .returning(RefreshSession.user_id)
+        )
+        user_id = db.execute(stmt).scalar()
+        db.commit()
+        return user_id
+
 
 refresh_session = CRUDRefreshSession(RefreshSession)
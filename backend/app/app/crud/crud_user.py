@@ -1,29 +1,68 @@
-from typing import Any
+from typing import Any, Type
 
+from sqlalchemy import lambda_stmt, select
 from sqlalchemy.orm import Session
 
+from app.core.cache import TTLCache
+from app.core.config import settings
 from app.core.security import get_password_hash, verify_password
 from app.crud.base import CRUDBase
 from app.models.user import User
-from app.schemas.user import UserCreate, UserUpdate
+from app.schemas.user import UserCreate, UserInDB, UserUpdate
 
 
 class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
+    def __init__(self, model: Type[User]):
+        super().__init__(model)
+        self.cache: TTLCache[UserInDB] = TTLCache(
+            maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS
+        )
+
+    # noinspection PyShadowingBuiltins
+    def get_cached(self, db: Session, *, id: int) -> UserInDB | None:
+        """
+        Snapshot of the user, served from the in-process cache when possible
+        """
+        snapshot = self.cache.get(id)
+        if snapshot is None:
+            db_obj = self.get(db, id=id)
+            if not db_obj:
+                return None
+            snapshot = UserInDB.from_orm(db_obj)
+            self.cache.set(id, snapshot)
+        return snapshot
+
+    # noinspection PyShadowingBuiltins
+    def invalidate(self, id: Any) -> None:
+        self.cache.invalidate(id)
+
     @staticmethod
     def get_by_email(db: Session, *, email: str) -> User | None:
-        return db.query(User).filter(User.email == email).first()
+        return db.execute(lambda_stmt(lambda: select(User).where(User.email == email))).scalars().first()
 
-    def create(self, db: Session, *, obj_in: UserCreate) -> User:
+    def create(
+            self,
+            db: Session,
+            *,
+            obj_in: UserCreate,
+            hashed_password: str | None = None
+    ) -> User:
+        """
+        `hashed_password` may be computed beforehand, e.g. with `get_password_hash_async`
+        """
+        if hashed_password is None:
+            hashed_password = get_password_hash(obj_in.password)
         # noinspection PyArgumentList
         db_obj = User(
             email=obj_in.email,
-            hashed_password=get_password_hash(obj_in.password),
+            hashed_password=hashed_password,
             full_name=obj_in.full_name,
             is_superuser=obj_in.is_superuser,
         )
         db.add(db_obj)
         db.commit()
         db.refresh(db_obj)
+        self.changed([db_obj])
         return db_obj
 
     def update(
@@ -31,16 +70,21 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
             db: Session,
             *,
             db_obj: User,
-            obj_in: UserUpdate | dict[str, Any]
+            obj_in: UserUpdate | dict[str, Any],
+            hashed_password: str | None = None
     ) -> User:
+        """
+        `hashed_password` of a new password may be computed beforehand, e.g. with `get_password_hash_async`
+        """
         if isinstance(obj_in, dict):
             update_data = obj_in
         else:
             update_data = obj_in.dict(exclude_unset=True)
-        if update_data["password"]:
-            hashed_password = get_password_hash(update_data["password"])
-            del update_data["password"]
+        if hashed_password is not None:
             update_data["hashed_password"] = hashed_password
+        elif update_data.get("password"):
+            update_data["hashed_password"] = get_password_hash(update_data["password"])
+        update_data.pop("password", None)
         return super().update(db, db_obj=db_obj, obj_in=update_data)
 
     def authenticate(
@@ -0,0 +1,57 @@
+import asyncio
+from typing import Any, Generic
+
+from app.crud.base import CRUDBase, ModelType
+from app.db.runner import SessionRunner
+
+
+class Loader(Generic[ModelType]):
+    def __init__(self, crud: CRUDBase[ModelType, Any, Any], db: SessionRunner):
+        """
+        Request scoped loader of objects by id. Ids asked by `get()` calls made in the same
+        event loop iteration, e.g. by `asyncio.gather()`, are fetched with a single `get_many()` query,
+        loaded objects are remembered until the end of the request.
+
+        **Parameters**
+
+        * `crud`: A CRUD object of the model
+        * `db`: Session runner of the request
+        """
+        self.crud = crud
+        self.db = db
+        self._loaded: dict[Any, asyncio.Future] = {}
+        self._pending: list[Any] = []
+        self._dispatches: set[asyncio.Task] = set()
+
+    # noinspection PyShadowingBuiltins
+    async def get(self, id: Any) -> ModelType | None:
+        future = self._loaded.get(id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._loaded[id] = future
+            if not self._pending:
+                # the task starts after callers already scheduled in this iteration add their ids
+                task = asyncio.create_task(self._dispatch())
+                self._dispatches.add(task)
+                task.add_done_callback(self._dispatches.discard)
+            self._pending.append(id)
+        # a cancelled caller must not cancel the result shared with other callers
+        return await asyncio.shield(future)
+
+    async def get_many(self, ids: list[Any]) -> list[ModelType | None]:
+        """
+        Objects with given `ids` in the same order, None for missing ones
+        """
+        return list(await asyncio.gather(*(self.get(id) for id in ids)))
+
+    async def _dispatch(self) -> None:
+        ids, self._pending = self._pending, []
+        try:
+            db_objs = await self.db.run(self.crud.get_many, ids=ids)
+        except Exception as e:
+            for id in ids:
+                self._loaded.pop(id).set_exception(e)
+            return
+        found = {db_obj.id: db_obj for db_obj in db_objs}
+        for id in ids:
+            self._loaded[id].set_result(found.get(id))
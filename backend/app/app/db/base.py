@@ -2,5 +2,6 @@
 # imported by Alembic
 from app.db.base_class import Base  # noqa
 from app.models.item import Item  # noqa
+from app.models.item_owner_stats import ItemOwnerStats  # noqa
 from app.models.user import User  # noqa
 from app.models.refresh_session import RefreshSession # noqa
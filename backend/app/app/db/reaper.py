@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+
+from starlette.concurrency import run_in_threadpool
+
+from app import crud
+from app.core.config import settings
+from app.db.session import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReaperStats:
+    batches: int = 0
+    rows_purged: int = 0
+    last_batch_seconds: float = 0.0
+    max_batch_seconds: float = 0.0
+
+    def record(self, rows: int, seconds: float) -> None:
+        self.batches += 1
+        self.rows_purged += rows
+        self.last_batch_seconds = seconds
+        self.max_batch_seconds = max(self.max_batch_seconds, seconds)
+
+
+stats = ReaperStats()
+
+
+def purge_batch(batch_size: int = settings.REFRESH_SESSION_REAPER_BATCH_SIZE) -> int:
+    """
+    Delete one batch of expired refresh sessions in its own transaction
+    """
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        rows = crud.refresh_session.remove_expired(db, limit=batch_size)
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+    stats.record(rows, elapsed)
+    logger.debug("Purged %d expired refresh sessions in %.3fs", rows, elapsed)
+    return rows
+
+
+def purge_expired_sessions(
+        batch_size: int = settings.REFRESH_SESSION_REAPER_BATCH_SIZE,
+        pause: float = settings.REFRESH_SESSION_REAPER_BATCH_PAUSE_SECONDS,
+) -> int:
+    """
+    Delete all expired refresh sessions batch by batch, returns number of deleted sessions
+    """
+    purged = 0
+    while True:
+        rows = purge_batch(batch_size)
+        purged += rows
+        if rows < batch_size:
+            return purged
+        time.sleep(pause)
+
+
+async def run_periodically(
+        interval: float = settings.REFRESH_SESSION_REAPER_INTERVAL_SECONDS,
+        batch_size: int = settings.REFRESH_SESSION_REAPER_BATCH_SIZE,
+        pause: float = settings.REFRESH_SESSION_REAPER_BATCH_PAUSE_SECONDS,
+) -> None:
+    """
+    Background task purging expired refresh sessions every `interval` seconds
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            purged = 0
+            while True:
+                rows = await run_in_threadpool(purge_batch, batch_size)
+                purged += rows
+                if rows < batch_size:
+                    break
+                await asyncio.sleep(pause)
+            if purged:
+                logger.info("Purged %d expired refresh sessions", purged)
+        except Exception as e:
+            logger.error(e)
@@ -0,0 +1,113 @@
+import asyncio
+import itertools
+import logging
+import threading
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# set on responses to writes, requests carrying it read from the primary
+PIN_TO_PRIMARY_COOKIE = "read_primary"
+
+
+class Replica:
+    def __init__(self, uri: str):
+        self.uri = uri
+        self.engine = create_engine(uri, pool_pre_ping=True, query_cache_size=settings.SQLALCHEMY_QUERY_CACHE_SIZE)
+        self.async_engine = None
+        if settings.SQLALCHEMY_ASYNC_MODE:
+            from sqlalchemy.ext.asyncio import create_async_engine
+
+            self.async_engine = create_async_engine(
+                "postgresql+asyncpg://" + uri.split("://", 1)[1],
+                pool_pre_ping=True,
+                query_cache_size=settings.SQLALCHEMY_QUERY_CACHE_SIZE
+            )
+        self.healthy = True
+
+    def check(self) -> bool:
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        except Exception as e:
+            if self.healthy:
+                logger.warning("Replica %r is unavailable: %s", self.engine.url, e)
+            self.healthy = False
+        else:
+            if not self.healthy:
+                logger.info("Replica %r is available again", self.engine.url)
+            self.healthy = True
+        return self.healthy
+
+
+class ReplicaSet:
+    def __init__(self, uris: list[str]):
+        """
+        Read replicas picked in round-robin order, skipping the ones which failed the last health check.
+
+        **Parameters**
+
+        * `uris`: DSNs of the replicas
+        """
+        self.replicas = [Replica(uri) for uri in uris]
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def choose(self) -> Replica | None:
+        """
+        Next healthy replica, None if there are none and reads have to fall back to the primary
+        """
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        with self._lock:
+            index = next(self._counter)
+        return healthy[index % len(healthy)]
+
+    def check_all(self) -> None:
+        for replica in self.replicas:
+            replica.check()
+
+    async def run_health_checks(self, interval: float = settings.REPLICA_HEALTH_CHECK_INTERVAL_SECONDS) -> None:
+        """
+        Background task checking all replicas every `interval` seconds
+        """
+        while True:
+            await run_in_threadpool(self.check_all)
+            await asyncio.sleep(interval)
+
+
+class PinToPrimaryMiddleware:
+    def __init__(self, app: ASGIApp, *, seconds: int):
+        """
+        Marks clients which made a successful write with a cookie living `seconds`,
+        so `deps.get_read_db()` sends their reads to the primary until replicas catch up
+        """
+        self.app = app
+        self.seconds = seconds
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS"):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "set-cookie",
+                    f"{PIN_TO_PRIMARY_COOKIE}=1; Max-Age={self.seconds}; Path=/; HttpOnly; SameSite=lax"
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+replica_set = ReplicaSet([str(uri) for uri in settings.SQLALCHEMY_REPLICA_URIS])
@@ -0,0 +1,107 @@
+from typing import Any, AsyncIterator, Callable, Iterator, TypeVar
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.response_cache import response_cache
+from app.db import session
+from app.db.replicas import Replica
+
+T = TypeVar("T")
+
+_done = object()
+
+
+class SessionRunner:
+    def __init__(self, db: Any):
+        """
+        Adapter letting async endpoints call synchronous CRUD functions with a session, so every query
+        is written once for both database drivers. Calls of one runner must not overlap,
+        like uses of a session.
+
+        **Parameters**
+
+        * `db`: The adapted session
+        """
+        self.db = db
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Result of `fn(session, *args, **kwargs)`
+        """
+        raise NotImplementedError
+
+    async def iterate(self, fn: Callable[..., Iterator[T]], *args: Any, **kwargs: Any) -> AsyncIterator[T]:
+        """
+        Values of the iterator `fn(session, *args, **kwargs)`, each one is pulled by a call of its own
+        """
+        iterator = await self.run(fn, *args, **kwargs)
+        try:
+            while (value := await self.run(lambda _: next(iterator, _done))) is not _done:
+                yield value
+        finally:
+            await self.run(lambda _: iterator.close())
+
+    async def close(self) -> None:
+        raise NotImplementedError
+
+    async def __aenter__(self) -> "SessionRunner":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+
+class ThreadedSessionRunner(SessionRunner):
+    """
+    Runs calls in the threadpool with a psycopg2 session, one thread at a time
+    """
+    db: Session
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        return await run_in_threadpool(fn, self.db, *args, **kwargs)
+
+    async def close(self) -> None:
+        await run_in_threadpool(self.db.close)
+
+
+class AsyncSessionRunner(SessionRunner):
+    """
+    Runs calls with `AsyncSession.run_sync()`, their queries are awaited on the event loop with asyncpg.
+    Response cache invalidations of a call are made in the threadpool after it if the cache backend is blocking
+    """
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        if not response_cache.backend.blocking:
+            return await self.db.run_sync(fn, *args, **kwargs)
+        tags: list[str] = []
+
+        def run_deferring(db: Session, *args: Any, **kwargs: Any) -> T:
+            # entered in the greenlet running `fn`, whose context may not be the one of the task
+            with response_cache.deferred_invalidation(tags):
+                return fn(db, *args, **kwargs)
+
+        try:
+            return await self.db.run_sync(run_deferring, *args, **kwargs)
+        finally:
+            if tags:
+                await run_in_threadpool(response_cache.invalidate, *dict.fromkeys(tags))
+
+    async def close(self) -> None:
+        await self.db.close()
+
+
+def session_runner(replica: Replica | None = None, *, threaded: bool = False) -> SessionRunner:
+    """
+    Runner of a new session of the primary database or of `replica`, using asyncpg if `SQLALCHEMY_ASYNC_MODE`
+    is enabled and `threaded` is not. Objects are not expired on commit in either case,
+    because they are used outside of the runner, e.g. by response serialization on the event loop
+    """
+    if settings.SQLALCHEMY_ASYNC_MODE and not threaded:
+        if replica is None:
+            return AsyncSessionRunner(session.AsyncSessionLocal())
+        return AsyncSessionRunner(session.AsyncSessionLocal(bind=replica.async_engine))
+    if replica is None:
+        return ThreadedSessionRunner(session.SessionLocal(expire_on_commit=False))
+    return ThreadedSessionRunner(session.SessionLocal(bind=replica.engine, expire_on_commit=False))
@@ -1,7 +1,102 @@
+import bisect
+import hashlib
+from typing import Any, Iterable
+
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
 
 from app.core.config import settings
 
-engine = create_engine(settings.SQLALCHEMY_DATABASE_URI, pool_pre_ping=True)
+engine = create_engine(
+    settings.SQLALCHEMY_DATABASE_URI, pool_pre_ping=True, query_cache_size=settings.SQLALCHEMY_QUERY_CACHE_SIZE
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = None
+AsyncSessionLocal = None
+if settings.SQLALCHEMY_ASYNC_MODE:
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    # asyncpg also prepares statements server-side and keeps them per connection
+    async_engine = create_async_engine(
+        settings.SQLALCHEMY_ASYNC_DATABASE_URI,
+        pool_pre_ping=True,
+        query_cache_size=settings.SQLALCHEMY_QUERY_CACHE_SIZE
+    )
+    # objects are not expired on commit, because lazy loading is not available outside of run_sync()
+    AsyncSessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine, class_=AsyncSession
+    )
+
+
+class HashRing:
+    def __init__(self, nodes: Iterable[str], *, virtual_nodes: int = 64):
+        """
+        Consistent hashing of keys to nodes. Every node owns `virtual_nodes` points of the ring,
+        so adding a node moves about 1/N of keys, all of them to the new node.
+
+        **Parameters**
+
+        * `nodes`: Names of the nodes
+        * `virtual_nodes`: Points per node, changing it moves keys between nodes
+        """
+        points = sorted((self.hash(f"{node}#{index}"), node) for node in nodes for index in range(virtual_nodes))
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        # stable across processes, unlike hash()
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def node(self, key: Any) -> str:
+        index = bisect.bisect(self._points, self.hash(str(key))) % len(self._points)
+        return self._nodes[index]
+
+
+class ShardRouter:
+    def __init__(self, shards: dict[str, str]):
+        """
+        Sessions of databases holding parts of a table split by owner id.
+
+        **Parameters**
+
+        * `shards`: DSNs by shard name, owners are assigned to names
+        """
+        self.names = list(shards)
+        self.ring = HashRing(self.names)
+        self.engines: dict[str, Engine] = {
+            name: create_engine(uri, pool_pre_ping=True, query_cache_size=settings.SQLALCHEMY_QUERY_CACHE_SIZE)
+            for name, uri in shards.items()
+        }
+        self.async_engines: dict[str, Any] = {}
+        if settings.SQLALCHEMY_ASYNC_MODE:
+            self.async_engines = {
+                name: create_async_engine(
+                    "postgresql+asyncpg://" + uri.split("://", 1)[1],
+                    pool_pre_ping=True,
+                    query_cache_size=settings.SQLALCHEMY_QUERY_CACHE_SIZE
+                )
+                for name, uri in shards.items()
+            }
+
+    def shard_for(self, owner_id: int) -> str:
+        return self.ring.node(owner_id)
+
+    def session(self, name: str, *, like: Session) -> Session:
+        """
+        New session of shard `name`. When `like` is the session given by `AsyncSession.run_sync()`,
+        the session uses asyncpg as well, so it doesn't block the event loop inside `run_sync()`.
+        Objects are not expired on commit, because they outlive the session
+        """
+        if like.get_bind().dialect.is_async:
+            engine = self.async_engines[name].sync_engine
+        else:
+            engine = self.engines[name]
+        return Session(bind=engine, autoflush=False, expire_on_commit=False)
+
+
+item_shards = None
+if settings.SQLALCHEMY_ITEM_SHARDS:
+    item_shards = ShardRouter({name: str(uri) for name, uri in settings.SQLALCHEMY_ITEM_SHARDS.items()})
@@ -0,0 +1,50 @@
+import argparse
+import logging
+from pathlib import Path
+
+from app import crud, schemas
+from app.core import importer
+from app.core.config import settings
+from app.db.session import SessionLocal
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import items from NDJSON or CSV file")
+    parser.add_argument("path", type=Path)
+    parser.add_argument(
+        "--format", type=schemas.ImportFormat, choices=list(schemas.ImportFormat),
+        help="File format, CSV for .csv files and NDJSON for others by default"
+    )
+    parser.add_argument("--owner", default=settings.FIRST_SUPERUSER, help="Email of the owner of imported items")
+    parser.add_argument("--chunk-size", type=int, default=settings.ITEMS_IMPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    import_format = args.format
+    if import_format is None:
+        is_csv = args.path.suffix.lower() == ".csv"
+        import_format = schemas.ImportFormat.csv if is_csv else schemas.ImportFormat.ndjson
+    db = SessionLocal()
+    try:
+        owner = crud.user.get_by_email(db, email=args.owner)
+        if not owner:
+            parser.error(f"User {args.owner} not found")
+        logger.info("Importing items from %s", args.path)
+        with args.path.open("rb") as file:
+            report = importer.import_items(
+                db, file, import_format=import_format, owner_id=owner.id, chunk_size=args.chunk_size
+            )
+    finally:
+        db.close()
+    for rejection in report.rejections:
+        logger.warning("Line %d rejected: %s", rejection.line, rejection.detail)
+    logger.info(
+        "Imported %d of %d rows in %.1fs (%.0f rows/s), %d rows rejected",
+        report.rows_imported, report.rows_read, report.seconds, report.rows_per_second, report.rows_rejected
+    )
+
+
+if __name__ == "__main__":
+    main()
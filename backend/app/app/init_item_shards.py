@@ -0,0 +1,38 @@
+import argparse
+import logging
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, text
+
+from app.core.config import settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def migrate_shard(name: str, uri: str, x_arguments: list[str]) -> None:
+    logger.info("Migrating item shard %s", name)
+    config = Config("alembic.ini", cmd_opts=argparse.Namespace(x=x_arguments))
+    config.attributes["configure_logger"] = False
+    # percent signs of the DSN would be taken for interpolation by configparser
+    config.set_main_option("sqlalchemy.url", uri.replace("%", "%%"))
+    command.upgrade(config, "head")
+    # owners live in the main database, so shards can't reference them
+    engine = create_engine(uri)
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE item DROP CONSTRAINT IF EXISTS item_owner_id_fkey"))
+        connection.execute(text("ALTER TABLE item_owner_stats DROP CONSTRAINT IF EXISTS item_owner_stats_owner_id_fkey"))
+    engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Apply migrations to item shards of SQLALCHEMY_ITEM_SHARDS")
+    parser.add_argument("-x", action="append", default=[], help="Additional arguments of migrations, like alembic -x")
+    args = parser.parse_args()
+    for name, uri in settings.SQLALCHEMY_ITEM_SHARDS.items():
+        migrate_shard(name, str(uri), args.x)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import argparse
+import itertools
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import requests
+
+from app.core.config import settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+API = settings.CURRENT_API_STR
+
+
+class Client:
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.local = threading.local()
+        token = self.session().post(
+            f"{base_url}{API}/login/",
+            data={
+                "username": settings.FIRST_SUPERUSER,
+                "password": settings.FIRST_SUPERUSER_PASSWORD,
+                "fingerprint": "load-test"
+            }
+        ).json()["access_token"]
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def session(self) -> requests.Session:
+        # connections are kept alive per thread, like clients of a real deployment
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def request(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+        response = self.session().request(method, f"{self.base_url}{API}{path}", headers=self.headers, **kwargs)
+        response.raise_for_status()
+        return response
+
+
+def scenarios(client: Client, *, item_id: int) -> dict[str, Callable[[], None]]:
+    """
+    Operations measured by name, each one is a request except `create_and_delete_item`
+    """
+    counter = itertools.count()
+
+    def create_and_delete_item() -> None:
+        created = client.request("POST", "/items/", json={"title": f"load test {next(counter)}"}).json()
+        client.request("DELETE", f"/items/{created['id']}")
+
+    return {
+        "read_user_me": lambda: client.request("GET", "/users/me"),
+        "read_item": lambda: client.request("GET", f"/items/{item_id}"),
+        "read_items": lambda: client.request("GET", "/items/", params={"limit": 100}),
+        "create_and_delete_item": create_and_delete_item,
+    }
+
+
+class LoginStorm:
+    def __init__(self, base_url: str, *, clients: int):
+        """
+        Clients logging in as the first superuser as fast as they can, while other scenarios are measured.
+        Each login verifies the password with bcrypt.
+        """
+        self.base_url = base_url
+        self.clients = clients
+        self.logins = 0
+        self.rejected = 0
+        self._stopped = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    def _login(self, fingerprint: str) -> None:
+        session = requests.Session()
+        data = {
+            "username": settings.FIRST_SUPERUSER,
+            "password": settings.FIRST_SUPERUSER_PASSWORD,
+            "fingerprint": fingerprint
+        }
+        while not self._stopped.is_set():
+            response = session.post(f"{self.base_url}{API}/login/", data=data)
+            if response.status_code == 503:
+                self.rejected += 1
+                continue
+            response.raise_for_status()
+            self.logins += 1
+
+    def __enter__(self) -> "LoginStorm":
+        self._threads = [
+            threading.Thread(target=self._login, args=(f"login-storm-{number}",), daemon=True)
+            for number in range(self.clients)
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+
+
+def cpu_seconds(pid: int) -> float | None:
+    """
+    User and system CPU time of process `pid`, None where /proc is not available
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            fields = file.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def measure(run: Callable[[], None], *, pid: int, concurrency: int, duration: float) -> dict[str, float]:
+    """
+    Calls `run` from `concurrency` threads for `duration` seconds, after a short warm-up
+    """
+    deadline = 0.0
+    latencies: list[float] = []
+
+    def worker() -> None:
+        while (started := time.perf_counter()) < deadline:
+            run()
+            latencies.append(time.perf_counter() - started)
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        deadline = time.perf_counter() + min(duration / 5, 2)
+        list(pool.map(lambda _: worker(), range(concurrency)))
+        latencies.clear()
+        cpu_before = cpu_seconds(pid)
+        started = time.perf_counter()
+        deadline = started + duration
+        list(pool.map(lambda _: worker(), range(concurrency)))
+        elapsed = time.perf_counter() - started
+        cpu_after = cpu_seconds(pid)
+    quantiles = statistics.quantiles(latencies, n=100)
+    result = {
+        "ops": len(latencies) / elapsed,
+        "p50_ms": quantiles[49] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+    }
+    if cpu_before is not None and cpu_after is not None:
+        result["cpu_ms"] = (cpu_after - cpu_before) / len(latencies) * 1000
+    return result
+
+
+def start_server(*, async_mode: bool, port: int, password_hash_workers: int) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "SQLALCHEMY_ASYNC_MODE": str(async_mode).lower(),
+        "PASSWORD_HASH_WORKERS": str(password_hash_workers),
+        # reads have to reach the database to compare its drivers
+        "RESPONSE_CACHE_TTL_SECONDS": "{}",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"], env=env
+    )
+    for _ in range(100):
+        try:
+            requests.get(f"http://127.0.0.1:{port}{API}/openapi.json").raise_for_status()
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError(f"Server didn't start on port {port}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare throughput and latency of endpoints served with psycopg2 and asyncpg sessions, "
+                    "one uvicorn process per mode against the database of the settings"
+    )
+    parser.add_argument("--modes", nargs="+", choices=["sync", "async"], default=["sync", "async"])
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per scenario")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--scenario", action="append", help="Run only these scenarios")
+    parser.add_argument(
+        "--login-storm", type=int, default=0, metavar="CLIENTS",
+        help="Clients logging in continuously while scenarios are measured"
+    )
+    parser.add_argument(
+        "--password-hash-workers", type=int, nargs="+", default=[settings.PASSWORD_HASH_WORKERS],
+        help="Compare servers with these numbers of bcrypt worker processes"
+    )
+    args = parser.parse_args()
+
+    rows = []
+    for mode, workers in itertools.product(args.modes, args.password_hash_workers):
+        server = start_server(async_mode=mode == "async", port=args.port, password_hash_workers=workers)
+        try:
+            base_url = f"http://127.0.0.1:{args.port}"
+            client = Client(base_url)
+            item_id = client.request("POST", "/items/", json={"title": "load test"}).json()["id"]
+            for name, run in scenarios(client, item_id=item_id).items():
+                if args.scenario and name not in args.scenario:
+                    continue
+                logger.info("Running %s in %s mode with %d hashing workers", name, mode, workers)
+                with LoginStorm(base_url, clients=args.login_storm) as storm:
+                    started = time.perf_counter()
+                    result = measure(run, pid=server.pid, concurrency=args.concurrency, duration=args.duration)
+                    elapsed = time.perf_counter() - started
+                if args.login_storm:
+                    result["logins"] = storm.logins / elapsed
+                    result["rejected"] = storm.rejected / elapsed
+                rows.append((name, mode, workers, result))
+            client.request("DELETE", f"/items/{item_id}")
+        finally:
+            server.terminate()
+            server.wait()
+    header = f"{'scenario':24} {'mode':6} {'hashers':>7} {'ops/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'CPU ms/req':>11}"
+    print(header + (f" {'logins/s':>9} {'503/s':>7}" if args.login_storm else ""))
+    for name, mode, workers, result in sorted(rows, key=lambda row: row[0]):
+        cpu = f"{result['cpu_ms']:11.2f}" if "cpu_ms" in result else f"{'-':>11}"
+        line = (
+            f"{name:24} {mode:6} {workers:7} {result['ops']:8.0f} {result['p50_ms']:8.1f} {result['p99_ms']:8.1f} "
+            f"{cpu}"
+        )
+        if args.login_storm:
+            line += f" {result['logins']:9.1f} {result['rejected']:7.1f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
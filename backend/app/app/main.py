@@ -1,11 +1,23 @@
-from fastapi import FastAPI
+import asyncio
+
+from fastapi import FastAPI, Request
+from starlette import status
 from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
 
 from app.api.api_v1.api import api_router
 from app.core.config import settings
+from app.core.export import ExportFormatUnavailable
+from app.core.importer import InvalidImportFile
+from app.core.hashing import PasswordHashingUnavailable, hasher
+from app.core.serialization import DefaultResponse
+from app.crud.base import InvalidCursor
+from app.db import reaper, replicas
 
 app = FastAPI(
-    title=settings.PROJECT_NAME, openapi_url=f"{settings.CURRENT_API_STR}/openapi.json"
+    title=settings.PROJECT_NAME,
+    openapi_url=f"{settings.CURRENT_API_STR}/openapi.json",
+    default_response_class=DefaultResponse,
 )
 
 # Set all CORS enabled origins
@@ -16,6 +28,74 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["ETag", "X-Next-Cursor", "X-Total-Count"],
     )
 
+if settings.SQLALCHEMY_REPLICA_URIS and settings.READ_YOUR_WRITES_SECONDS:
+    app.add_middleware(replicas.PinToPrimaryMiddleware, seconds=settings.READ_YOUR_WRITES_SECONDS)
+
 app.include_router(api_router, prefix=settings.CURRENT_API_STR)
+
+
+@app.exception_handler(PasswordHashingUnavailable)
+async def password_hashing_unavailable_handler(request: Request, exc: PasswordHashingUnavailable) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server is busy, try again later"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(InvalidCursor)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursor) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content={"detail": "Invalid cursor"},
+    )
+
+
+@app.exception_handler(ExportFormatUnavailable)
+async def export_format_unavailable_handler(request: Request, exc: ExportFormatUnavailable) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_501_NOT_IMPLEMENTED,
+        content={"detail": str(exc)},
+    )
+
+
+@app.exception_handler(InvalidImportFile)
+async def invalid_import_file_handler(request: Request, exc: InvalidImportFile) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content={"detail": str(exc)},
+    )
+
+
+@app.on_event("startup")
+async def start_refresh_session_reaper() -> None:
+    if settings.REFRESH_SESSION_REAPER_INTERVAL_SECONDS:
+        app.state.refresh_session_reaper = asyncio.create_task(reaper.run_periodically())
+
+
+@app.on_event("startup")
+async def start_replica_health_checks() -> None:
+    if replicas.replica_set.replicas:
+        app.state.replica_health_checks = asyncio.create_task(replicas.replica_set.run_health_checks())
+
+
+@app.on_event("shutdown")
+def shutdown_password_hasher() -> None:
+    hasher.shutdown()
+
+
+@app.on_event("shutdown")
+def stop_refresh_session_reaper() -> None:
+    task = getattr(app.state, "refresh_session_reaper", None)
+    if task is not None:
+        task.cancel()
+
+
+@app.on_event("shutdown")
+def stop_replica_health_checks() -> None:
+    task = getattr(app.state, "replica_health_checks", None)
+    if task is not None:
+        task.cancel()
@@ -1,3 +1,4 @@
 from .item import Item
+from .item_owner_stats import ItemOwnerStats
 from .user import User
 from .refresh_session import RefreshSession
@@ -1,7 +1,8 @@
 from datetime import datetime
 
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Computed, ForeignKey, Integer, String, DateTime, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred, relationship
 
 from app.db.base_class import Base
 
@@ -9,9 +10,25 @@ from app.db.base_class import Base
 class Item(Base):
     __tablename__ = "item"
 
-    id = Column(Integer, primary_key=True, index=True)
-    title = Column(String, index=True)
-    description = Column(String, index=True)
-    owner_id = Column(Integer, ForeignKey("user.id"))
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
+    description = Column(String)
+    # hash partition key of the table, NOT NULL since migration f0c7a4d2e915
+    owner_id = Column(Integer, ForeignKey("user.id"), nullable=False)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # version of the row, changed by every update. See app.core.etag
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # full-text search document, title words rank above description words. See CRUDItem.search()
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B')",
+        persisted=True
+    )))
     owner = relationship("User", back_populates="items")
+
+    __table_args__ = (
+        # keyset pagination order, see CRUDBase.paginate(), versions of a page are read from the index only
+        Index("ix_item_owner_id_created_at_id", "owner_id", "created_at", "id", postgresql_include=["updated_at"]),
+        Index("ix_item_created_at_id", "created_at", "id", postgresql_include=["updated_at"]),
+        Index("ix_item_search_vector", "search_vector", postgresql_using="gin"),
+    )
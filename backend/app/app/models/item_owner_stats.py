@@ -0,0 +1,14 @@
+from sqlalchemy import BigInteger, Column, ForeignKey, Integer
+
+from app.db.base_class import Base
+
+
+class ItemOwnerStats(Base):
+    """
+    Number of items of every owner, maintained by triggers on the item table
+    in the same transaction as the items themselves
+    """
+    __tablename__ = "item_owner_stats"
+
+    owner_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    item_count = Column(BigInteger, nullable=False, default=0)
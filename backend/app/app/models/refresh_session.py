@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index, LargeBinary
 from sqlalchemy.orm import relationship
 
 from app.db.base_class import Base
@@ -9,11 +9,15 @@ from app.db.base_class import Base
 class RefreshSession(Base):
     __tablename__ = "refresh_session"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("user.id"))
-    refresh_token = Column(String, unique=True, index=True, nullable=False)
+    refresh_token_hash = Column(LargeBinary(32), unique=True, index=True, nullable=False)  # see token_digest()
     fingerprint = Column(String, nullable=False)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
-    expires_in = Column(DateTime, nullable=False,
+    expires_in = Column(DateTime, nullable=False, index=True,
                         default=datetime.utcnow)  # expires in the moment of creation by default
     user = relationship("User")
+
+    __table_args__ = (
+        Index("ix_refresh_session_user_id_fingerprint", "user_id", "fingerprint", unique=True),
+    )
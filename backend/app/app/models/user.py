@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Boolean, Column, Integer, String, DateTime
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, Index
 from sqlalchemy.orm import relationship
 
 from app.db.base_class import Base
@@ -9,11 +9,18 @@ from app.db.base_class import Base
 class User(Base):
     __tablename__ = "user"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     full_name = Column(String, index=True)
     email = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean(), default=True)
     is_superuser = Column(Boolean(), default=False)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # version of the row, changed by every update. See app.core.etag
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
     items = relationship("Item", back_populates="owner")
+
+    # keyset pagination order, see CRUDBase.paginate(), versions of a page are read from the index only
+    __table_args__ = (
+        Index("ix_user_created_at_id", "created_at", "id", postgresql_include=["updated_at"]),
+    )
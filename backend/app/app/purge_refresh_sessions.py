@@ -0,0 +1,19 @@
+import logging
+
+from app.db import reaper
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    logger.info("Purging expired refresh sessions")
+    purged = reaper.purge_expired_sessions()
+    logger.info(
+        "Purged %d expired refresh sessions in %d batches, slowest batch took %.3fs",
+        purged, reaper.stats.batches, reaper.stats.max_batch_seconds
+    )
+
+
+if __name__ == "__main__":
+    main()
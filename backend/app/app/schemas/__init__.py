@@ -1,5 +1,10 @@
-from .item import Item, ItemCreate, ItemInDB, ItemUpdate
+from .export import ExportFormat
+from .item import (
+    Item, ItemBulkResult, ItemBulkUpdate, ItemCreate, ItemInDB, ItemOwnerCount, ItemStats, ItemUpdate
+)
+from .item_import import ImportFormat, ItemImportRejection, ItemImportReport
 from .msg import Msg
 from .refresh_session import RefreshSessionBase, RefreshSessionCreate, RefreshSessionInDBBase
+from .response_cache import ResponseCacheRouteStats, ResponseCacheStats
 from .token import TokenPair, AccessTokenPayload, RefreshTokenPayload
 from .user import User, UserCreate, UserInDB, UserUpdate
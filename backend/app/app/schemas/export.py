@@ -0,0 +1,7 @@
+from enum import Enum
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+    arrow = "arrow"
@@ -17,6 +17,11 @@ class ItemUpdate(ItemBase):
     pass
 
 
+# Properties to receive on bulk item update
+class ItemBulkUpdate(ItemUpdate):
+    id: int
+
+
 # Properties shared by models stored in DB
 class ItemInDBBase(ItemBase):
     id: int
@@ -35,3 +40,28 @@ class Item(ItemInDBBase):
 # Properties stored in DB
 class ItemInDB(ItemInDBBase):
     pass
+
+
+# Outcome of a single item of a bulk request
+class ItemBulkResult(BaseModel):
+    id: int
+    status_code: int
+    detail: str | None = None
+    item: Item | None = None
+
+
+# Number of items of an owner
+class ItemOwnerCount(BaseModel):
+    owner_id: int
+    item_count: int
+
+    class Config:
+        orm_mode = True
+
+
+# Item totals visible to the current user
+class ItemStats(BaseModel):
+    total: int
+    # whether `total` is a planner estimate, see ITEMS_TOTAL_COUNT_EXACT setting
+    estimated: bool = False
+    owners: list[ItemOwnerCount] = []
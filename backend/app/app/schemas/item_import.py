@@ -0,0 +1,25 @@
+from enum import Enum
+
+from pydantic import BaseModel
+
+
+class ImportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+# Row of an import which failed validation, `line` is 1-based line number in the uploaded file
+class ItemImportRejection(BaseModel):
+    line: int
+    detail: str
+
+
+# Outcome of an item import
+class ItemImportReport(BaseModel):
+    rows_read: int = 0
+    rows_imported: int = 0
+    rows_rejected: int = 0
+    # first rejected rows only, see ITEMS_IMPORT_MAX_REPORTED_REJECTIONS setting
+    rejections: list[ItemImportRejection] = []
+    seconds: float = 0.0
+    rows_per_second: float = 0.0
@@ -30,4 +30,4 @@ class RefreshSessionInDBBase(RefreshSessionBase):
 
 # Properties stored in DB
 class RefreshSessionInDB(RefreshSessionInDBBase):
-    refresh_token: str | None = None
+    refresh_token_hash: bytes
@@ -0,0 +1,15 @@
+from pydantic import BaseModel
+
+
+# Response cache lookups of an endpoint in this process
+class ResponseCacheRouteStats(BaseModel):
+    hits: int
+    misses: int
+    hit_ratio: float
+
+
+class ResponseCacheStats(BaseModel):
+    routes: dict[str, ResponseCacheRouteStats]
+    # size of the in-process store, unknown with RESPONSE_CACHE_BACKEND "redis"
+    entries: int | None = None
+    bytes: int | None = None
@@ -0,0 +1,119 @@
+"""
+Export of a large number of items through the endpoint, with the resident memory of the process sampled
+whenever a chunk of the response is sent. The app is called directly, a test client would collect the body.
+
+Items are seeded in a transaction which is rolled back at the end, the endpoint reads them in it.
+"""
+import asyncio
+import os
+from datetime import datetime
+from typing import Any, Generator
+
+import pytest
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app import schemas
+from app.api import deps
+from app.core.config import settings
+from app.db.runner import ThreadedSessionRunner
+from app.db.session import engine
+from app.main import app
+
+EXPORT_ROWS = 5_000_000
+# allowed growth of resident memory while the export is streamed, materialized rows would take about a gigabyte
+MAX_RSS_GROWTH = 100 * 1024 * 1024
+
+pytestmark = pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="resident memory is read from /proc")
+
+
+def resident_bytes() -> int:
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+@pytest.fixture
+def connection() -> Generator[Connection, None, None]:
+    connection = engine.connect()
+    transaction = connection.begin()
+    try:
+        yield connection
+    finally:
+        transaction.rollback()
+        connection.close()
+
+
+@pytest.fixture
+def owner(connection: Connection) -> Generator[schemas.UserInDB, None, None]:
+    now = datetime.utcnow()
+    owner_id = connection.exec_driver_sql(
+        'INSERT INTO "user" (email, hashed_password, is_active, is_superuser, created_at, updated_at) '
+        "VALUES ('export@example.com', 'x', true, false, %(now)s, %(now)s) RETURNING id",
+        {"now": now}
+    ).scalar()
+    connection.exec_driver_sql(f"""
+        INSERT INTO item (title, description, owner_id, created_at, updated_at)
+        SELECT (ARRAY['red', 'green', 'blue', 'old', 'new'])[1 + mod(g, 5)] || ' '
+               || (ARRAY['lamp', 'chair', 'table', 'shelf', 'desk', 'sofa'])[1 + mod(g, 6)],
+               'Item of the export test', {owner_id}, now(), now()
+        FROM generate_series(1, {EXPORT_ROWS}) AS g
+    """)
+    yield schemas.UserInDB(id=owner_id, email="export@example.com", hashed_password="x", updated_at=now)
+
+
+@pytest.fixture
+def read_db(connection: Connection) -> Generator[None, None, None]:
+    async def get_read_db() -> ThreadedSessionRunner:
+        return ThreadedSessionRunner(Session(bind=connection))
+
+    app.dependency_overrides[deps.get_read_db] = get_read_db
+    try:
+        yield
+    finally:
+        del app.dependency_overrides[deps.get_read_db]
+
+
+async def export(query_string: bytes) -> dict[str, Any]:
+    """
+    Status, number of lines and bytes of the body, and peak growth of resident memory over the one before the request
+    """
+    path = f"{settings.CURRENT_API_STR}/items/export"
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "root_path": "", "query_string": query_string, "headers": [],
+        "server": ("testserver", 80), "client": ("testclient", 50000),
+    }
+    result = {"status": None, "lines": 0, "bytes": 0, "rss_growth": 0}
+    baseline = resident_bytes()
+    requested = False
+
+    async def receive() -> dict[str, Any]:
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # the client stays connected until the response is complete
+        await asyncio.Event().wait()
+
+    async def send(message: dict[str, Any]) -> None:
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            body = message.get("body", b"")
+            result["lines"] += body.count(b"\n")
+            result["bytes"] += len(body)
+            result["rss_growth"] = max(result["rss_growth"], resident_bytes() - baseline)
+
+    await app(scope, receive, send)
+    return result
+
+
+def test_export_streams_rows_in_bounded_memory(owner: schemas.UserInDB, read_db: None) -> None:
+    app.dependency_overrides[deps.get_current_active_user] = lambda: owner
+    try:
+        result = asyncio.run(export(b"format=ndjson"))
+    finally:
+        del app.dependency_overrides[deps.get_current_active_user]
+    assert result["status"] == 200
+    assert result["lines"] == EXPORT_ROWS
+    assert result["rss_growth"] < MAX_RSS_GROWTH, f"{result['rss_growth']} bytes more resident memory"
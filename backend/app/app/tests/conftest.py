@@ -0,0 +1,15 @@
+from typing import Generator
+
+import pytest
+from sqlalchemy.orm import Session
+
+from app.db.session import SessionLocal
+
+
+@pytest.fixture(scope="session")
+def db() -> Generator[Session, None, None]:
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,55 @@
+import asyncio
+import gc
+
+from sqlalchemy.exc import IntegrityError
+
+from app.crud.batching import WriteBatcher
+
+
+async def failing_flush(values: list[int]) -> list[int]:
+    raise IntegrityError("INSERT INTO item ...", {}, Exception("duplicate key"))
+
+
+def test_failed_flush_raises_own_exception_in_every_task() -> None:
+    async def submit_all() -> list[BaseException]:
+        batcher = WriteBatcher(failing_flush, max_size=2, max_wait=5)
+        return await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+
+    first, second = asyncio.run(submit_all())
+    assert isinstance(first, IntegrityError) and isinstance(second, IntegrityError)
+    assert first is not second
+    assert first.__cause__ is second.__cause__
+    assert first.__traceback__ is not second.__traceback__
+
+
+def test_cancelled_submitter_is_written_without_unretrieved_exception() -> None:
+    flushed: list[list[int]] = []
+    errors: list[dict] = []
+
+    async def flush(values: list[int]) -> list[int]:
+        flushed.append(values)
+        return await failing_flush(values)
+
+    async def cancel_one_submitter() -> type[BaseException]:
+        batcher = WriteBatcher(flush, max_size=3, max_wait=5)
+        cancelled = asyncio.create_task(batcher.submit(1))
+        kept = asyncio.create_task(batcher.submit(2))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        kept_error, _ = await asyncio.gather(kept, batcher.submit(3), return_exceptions=True)
+        # the traceback of the error holds the batch with every future
+        return type(kept_error)
+
+    async def submit_all() -> type[BaseException]:
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        error_type = await cancel_one_submitter()
+        # the finished flush task holding the batch is released by the next iteration of the loop,
+        # unretrieved exceptions of its futures are reported when they're collected
+        await asyncio.sleep(0)
+        gc.collect()
+        return error_type
+
+    assert asyncio.run(submit_all()) is IntegrityError
+    assert flushed == [[1, 2, 3]]
+    assert errors == []
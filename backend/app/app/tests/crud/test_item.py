@@ -0,0 +1,81 @@
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.db.session import SessionLocal, engine
+from app.models.item import Item
+from app.tests.utils.item import create_random_item
+from app.tests.utils.utils import count_statements, random_lower_string
+
+
+def test_update_by_owner_is_single_statement(db: Session) -> None:
+    item = create_random_item(db)
+    title = random_lower_string()
+    with count_statements(engine) as statements:
+        found, updated = crud.item.update_by_owner(db, id=item.id, obj_in={"title": title}, owner_id=item.owner_id)
+    assert len(statements) == 1
+    assert found and updated.title == title
+    crud.item.remove(db, id=item.id)
+
+
+def test_update_by_owner_of_other_owner(db: Session) -> None:
+    item = create_random_item(db)
+    with count_statements(engine) as statements:
+        found, updated = crud.item.update_by_owner(db, id=item.id, obj_in={"title": "x"}, owner_id=item.owner_id + 1)
+    assert len(statements) == 1
+    assert found and updated is None
+    assert crud.item.update_by_owner(db, id=-1, obj_in={"title": "x"}, owner_id=None) == (False, None)
+    crud.item.remove(db, id=item.id)
+
+
+def test_update_without_fields_keeps_updated_at(db: Session) -> None:
+    item = create_random_item(db)
+    updated_at = item.updated_at
+    with count_statements(engine) as statements:
+        found, updated = crud.item.update_by_owner(db, id=item.id, obj_in={}, owner_id=item.owner_id)
+    assert len(statements) == 1
+    assert not statements[0].lstrip().upper().startswith("WITH CHANGED AS (UPDATE")
+    assert found and updated.updated_at == updated_at
+    assert crud.item.update_by_owner(db, id=item.id, obj_in={}, owner_id=item.owner_id + 1) == (True, None)
+    db.expire_all()
+    assert db.get(Item, item.id).updated_at == updated_at
+    crud.item.remove(db, id=item.id)
+
+
+# noinspection PyShadowingBuiltins
+def test_remove_by_owner_is_single_statement(db: Session) -> None:
+    item = create_random_item(db)
+    # attributes expire on commit, they're read before statements are counted
+    id, owner_id = item.id, item.owner_id
+    with count_statements(engine) as statements:
+        assert crud.item.remove_by_owner(db, id=id, owner_id=owner_id + 1) == (True, None)
+    assert len(statements) == 1
+    with count_statements(engine) as statements:
+        found, removed = crud.item.remove_by_owner(db, id=id, owner_id=owner_id)
+    assert len(statements) == 1
+    assert found and removed.id == id
+    assert crud.item.remove_by_owner(db, id=id, owner_id=None) == (False, None)
+
+
+def test_stream_outlives_idle_in_transaction_timeout_of_server(db: Session) -> None:
+    item = create_random_item(db)
+    owner_id = item.owner_id
+    items = [item, create_random_item(db, owner_id=owner_id)]
+    stream_db = SessionLocal()
+    try:
+        stream_db.execute(text("SET idle_in_transaction_session_timeout = '1s'"))
+        stream_db.commit()
+        batches = crud.item.stream(stream_db, owner_id=owner_id, batch_size=1, idle_timeout=60)
+        first = next(batches)
+        # a client reading slower than the database leaves the transaction of the cursor idle
+        time.sleep(1.5)
+        rest = list(batches)
+        stream_db.execute(text("RESET idle_in_transaction_session_timeout"))
+        stream_db.commit()
+    finally:
+        stream_db.close()
+    assert len(first) == 1 and sum(map(len, rest)) == 1
+    for item in items:
+        crud.item.remove(db, id=item.id)
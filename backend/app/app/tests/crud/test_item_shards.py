@@ -0,0 +1,103 @@
+from pathlib import Path
+from typing import Generator
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from app.crud.crud_item import ShardedCRUDItem
+from app.db.session import ShardRouter
+from app.models.item import Item
+from app.schemas.item import ItemCreate
+
+# Item without the Postgres full-text search column, which SQLite stand-ins can't generate
+ITEM_TABLE = """
+    CREATE TABLE item (
+        id INTEGER PRIMARY KEY,
+        title VARCHAR,
+        description VARCHAR,
+        owner_id INTEGER NOT NULL,
+        created_at DATETIME NOT NULL,
+        updated_at DATETIME NOT NULL
+    )
+"""
+
+
+@pytest.fixture
+def shards(tmp_path: Path) -> ShardRouter:
+    shards = ShardRouter({name: f"sqlite:///{tmp_path / name}.db" for name in ("a", "b")})
+    for engine in shards.engines.values():
+        with engine.begin() as connection:
+            connection.exec_driver_sql(ITEM_TABLE)
+    return shards
+
+
+@pytest.fixture
+def db(tmp_path: Path) -> Generator[Session, None, None]:
+    db = Session(bind=create_engine(f"sqlite:///{tmp_path / 'main'}.db"))
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def owners_of(shards: ShardRouter) -> dict[str, int]:
+    """
+    An owner id of every shard
+    """
+    owners: dict[str, int] = {}
+    owner_id = 1
+    while len(owners) < len(shards.names):
+        owners.setdefault(shards.shard_for(owner_id), owner_id)
+        owner_id += 1
+    return owners
+
+
+def shard_ids(shards: ShardRouter, name: str) -> list[int]:
+    with Session(bind=shards.engines[name]) as shard_db:
+        return shard_db.execute(select(Item.id).order_by(Item.id)).scalars().all()
+
+
+def test_items_are_created_in_shard_of_owner(db: Session, shards: ShardRouter) -> None:
+    crud_item = ShardedCRUDItem(Item, shards)
+    owners = owners_of(shards)
+    created = {
+        name: crud_item.create_with_owner(db, obj_in=ItemCreate(title=name), owner_id=owner_id)
+        for name, owner_id in owners.items()
+    }
+    created_multi = crud_item.create_multi(db, objs_in=[
+        {"title": name, "owner_id": owner_id} for name, owner_id in owners.items()
+    ])
+    ids = [db_obj.id for db_obj in [*created.values(), *created_multi]]
+    assert len(set(ids)) == len(ids)
+    for name, db_obj in created.items():
+        assert db_obj.id in shard_ids(shards, name)
+        assert crud_item.get(db, id=db_obj.id).title == name
+    for name, owner_id in owners.items():
+        page = crud_item.get_multi_by_owner(db, owner_id=owner_id)
+        assert [db_obj.title for db_obj in page] == [name, name]
+    page = crud_item.get_multi(db, limit=3)
+    assert [db_obj.id for db_obj in page] == sorted(ids)[:3]
+
+
+def test_allocated_ids_follow_largest_shard_id(db: Session, shards: ShardRouter) -> None:
+    owners = owners_of(shards)
+    ShardedCRUDItem(Item, shards).create_multi(db, objs_in=[
+        {"id": 100, "title": "x", "owner_id": owners["b"]}
+    ])
+    crud_item = ShardedCRUDItem(Item, shards)
+    db_obj = crud_item.create_with_owner(db, obj_in=ItemCreate(title="y"), owner_id=owners["a"])
+    assert db_obj.id == 101
+    assert shard_ids(shards, "a") == [101]
+
+
+def test_create_routes_by_owner(db: Session, shards: ShardRouter) -> None:
+    crud_item = ShardedCRUDItem(Item, shards)
+    owner_id = owners_of(shards)["b"]
+    db_obj = crud_item.create(db, obj_in={"title": "x", "owner_id": owner_id})
+    assert db_obj.owner_id == owner_id
+    assert shard_ids(shards, "b") == [db_obj.id]
+    updated = crud_item.update(db, db_obj=db_obj, obj_in={"title": "y"})
+    assert crud_item.get(db, id=updated.id).title == "y"
+    with pytest.raises(TypeError):
+        crud_item.create(db, obj_in=ItemCreate(title="x"))
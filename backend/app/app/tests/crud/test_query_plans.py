@@ -0,0 +1,293 @@
+"""
+Plans of the statements sent by the CRUD objects, read with EXPLAIN (FORMAT JSON) against a realistic number of rows.
+A plan reading a large table sequentially fails its test, unless the operation reads the whole table by design.
+
+Rows are seeded and analyzed in a transaction which is rolled back at the end, CRUD objects run in it as well,
+their commits don't end it. Seeded tables are vacuumed first, so rows rolled back by earlier runs
+don't make them larger than their rows and plans are the same on a new database and on a used one.
+"""
+import json
+from datetime import timedelta
+from typing import Any, Callable, Generator, Iterator, NamedTuple
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app.crud.base import CRUDBase
+from app.crud.crud_item import CRUDItem
+from app.crud.crud_refresh_session import CRUDRefreshSession
+from app.crud.crud_user import CRUDUser
+from app.db.session import engine
+from app.models.item import Item
+from app.models.refresh_session import RefreshSession
+from app.models.user import User
+from app.schemas.item import ItemCreate
+from app.schemas.refresh_session import RefreshSessionCreate
+from app.schemas.user import UserCreate
+from app.tests.utils.utils import random_email, random_lower_string
+
+# seeded rows, every user owns items
+USERS = 20_000
+ITEMS = 200_000
+SESSIONS = 20_000
+# tables and partitions with at least this many rows must not be read sequentially
+LARGE_TABLE_ROWS = 10_000
+# tables filled by the seed, partitions of item are processed with it
+SEEDED_TABLES = '"user", item, item_owner_stats, refresh_session'
+# word of every 100th item, searches of it must use the full-text index
+RARE_WORD = "zeppelin"
+
+# operations reading every row of a table by design, with the reason
+FULL_SCANS = {
+    "item.stream": "export of all items reads every row",
+    "item.count": "exact number of all items sums every owner counter",
+    "item.owner_counts": "owners with most items are ranked over every owner counter",
+}
+
+item = CRUDItem(Item)
+user = CRUDUser(User)
+refresh_session = CRUDRefreshSession(RefreshSession)
+
+
+class Seed(NamedTuple):
+    user_id: int
+    email: str
+    item_id: int
+    item_ids: list[int]
+
+
+@pytest.fixture(scope="module")
+def connection() -> Generator[Connection, None, None]:
+    # the seed refills the space of rows rolled back earlier instead of growing the tables
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as vacuum:
+        vacuum.exec_driver_sql(f"VACUUM {SEEDED_TABLES}")
+    connection = engine.connect()
+    transaction = connection.begin()
+    try:
+        yield connection
+    finally:
+        transaction.rollback()
+        connection.close()
+
+
+@pytest.fixture(scope="module")
+def seed(connection: Connection) -> Seed:
+    first_user = connection.exec_driver_sql(f"""
+        INSERT INTO "user" (email, hashed_password, full_name, is_active, is_superuser, created_at, updated_at)
+        SELECT 'plans' || g || '@example.com', 'x', 'User ' || g, true, false,
+               now() - g * interval '1 minute', now() - g * interval '1 minute'
+        FROM generate_series(1, {USERS}) AS g
+        RETURNING id
+    """).scalars().all()[0]
+    connection.exec_driver_sql(f"""
+        INSERT INTO item (title, description, owner_id, created_at, updated_at)
+        SELECT (ARRAY['red', 'green', 'blue', 'old', 'new'])[1 + mod(g, 5)] || ' '
+               || (ARRAY['lamp', 'chair', 'table', 'shelf', 'desk', 'sofa'])[1 + mod(g, 6)]
+               || CASE WHEN mod(g, 100) = 0 THEN ' {RARE_WORD}' ELSE '' END,
+               'Item number ' || g || ' of the plan test',
+               {first_user} + mod(g, {USERS}),
+               now() - g * interval '1 second', now() - g * interval '1 second'
+        FROM generate_series(1, {ITEMS}) AS g
+    """)
+    connection.exec_driver_sql(f"""
+        INSERT INTO refresh_session (user_id, refresh_token_hash, fingerprint, created_at, expires_in)
+        SELECT {first_user} + mod(g, {USERS}), sha256(convert_to('plans' || g, 'UTF8')), 'fingerprint ' || g,
+               now(), now() + (g - {SESSIONS} / 100) * interval '1 minute'
+        FROM generate_series(1, {SESSIONS}) AS g
+    """)
+    # new rows wait in the pending list of a GIN index until vacuum, which makes the index look expensive
+    connection.exec_driver_sql(
+        "SELECT gin_clean_pending_list(indexrelid) FROM pg_index "
+        "JOIN pg_class ON pg_class.oid = indexrelid JOIN pg_am ON pg_am.oid = pg_class.relam "
+        "WHERE amname = 'gin' AND relkind = 'i'"
+    )
+    connection.exec_driver_sql(f"ANALYZE {SEEDED_TABLES}")
+    item_ids = connection.exec_driver_sql(
+        f"SELECT id FROM item WHERE owner_id = {first_user} ORDER BY id LIMIT 10"
+    ).scalars().all()
+    return Seed(user_id=first_user, email="plans1@example.com", item_id=item_ids[0], item_ids=item_ids)
+
+
+@pytest.fixture(scope="module")
+def large_tables(connection: Connection, seed: Seed) -> set[str]:
+    return set(connection.exec_driver_sql(
+        "SELECT relname FROM pg_class "
+        f"WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace AND reltuples >= {LARGE_TABLE_ROWS}"
+    ).scalars())
+
+
+@pytest.fixture
+def db(connection: Connection, seed: Seed) -> Generator[Session, None, None]:
+    db = Session(bind=connection)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def explained_statements(connection: Connection, run: Callable[[], Any]) -> list[tuple[str, dict[str, Any]]]:
+    """
+    Statements sent by `run()` with their plans. Statements which can't be explained, e.g. DDL, are left out
+    """
+    sent: list[tuple[str, Any]] = []
+
+    def after_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any, *args: Any) -> None:
+        sent.append((statement, parameters))
+
+    event.listen(connection, "after_cursor_execute", after_cursor_execute)
+    try:
+        run()
+    finally:
+        event.remove(connection, "after_cursor_execute", after_cursor_execute)
+    plans = []
+    for statement, parameters in sent:
+        if statement.lstrip().split(None, 1)[0].upper() not in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"):
+            continue
+        if isinstance(parameters, list):
+            # executemany, the first row stands for the others
+            parameters = parameters[0]
+        plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+        plans.append((statement, (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]))
+    return plans
+
+
+def nodes(plan: dict[str, Any]) -> Iterator[dict[str, Any]]:
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from nodes(child)
+
+
+def sequential_scans(plan: dict[str, Any]) -> Iterator[str]:
+    for node in nodes(plan):
+        if node["Node Type"] == "Seq Scan":
+            yield node["Relation Name"]
+
+
+def first_batch(batches: Iterator[Any]) -> Any:
+    return next(batches, None)
+
+
+def new_items(seed: Seed, count: int) -> list[dict[str, Any]]:
+    return [{"title": random_lower_string(), "owner_id": seed.user_id} for _ in range(count)]
+
+
+def new_session(db: Session, seed: Seed) -> str:
+    token = random_lower_string()
+    refresh_session.create(db, obj_in=RefreshSessionCreate(
+        user_id=seed.user_id, refresh_token=token, fingerprint=random_lower_string(), expires_delta=timedelta(days=1)
+    ))
+    return token
+
+
+def user_page_cursor(db: Session) -> str:
+    return CRUDBase.next_cursor(user.get_multi(db, limit=10), limit=10)
+
+
+CASES: dict[str, Callable[[Session, Seed], Any]] = {
+    # CRUDBase
+    "item.get": lambda db, seed: item.get(db, id=seed.item_id),
+    "item.get_row": lambda db, seed: item.get_row(db, id=seed.item_id, columns=["owner_id", "updated_at"]),
+    "item.get_many": lambda db, seed: item.get_many(db, ids=seed.item_ids),
+    "item.get_multi": lambda db, seed: item.get_multi(db, limit=100),
+    "item.get_multi.offset": lambda db, seed: item.get_multi(db, offset=1000, limit=100),
+    "item.get_multi.versions": lambda db, seed: item.get_multi(db, limit=100, columns=item.version_columns),
+    "user.get_multi.cursor": lambda db, seed: user.get_multi(db, cursor=user_page_cursor(db), limit=100),
+    "item.create_multi": lambda db, seed: item.create_multi(db, objs_in=new_items(seed, 10)),
+    "item.create_each": lambda db, seed: item.create_each(db, objs_in=new_items(seed, 10)),
+    "item.update": lambda db, seed: item.update(db, db_obj=item.get(db, id=seed.item_id), obj_in={"title": "x"}),
+    "item.update_if": lambda db, seed: item.update_if(db, id=seed.item_id, obj_in={"title": "y"}),
+    "item.update_if.unchanged": lambda db, seed: item.update_if(db, id=seed.item_id, obj_in={}),
+    "item.update_multi": lambda db, seed: item.update_multi(
+        db, objs_in=[{"id": id, "title": "z"} for id in seed.item_ids[:5]]
+    ),
+    "item.remove": lambda db, seed: item.remove(db, id=item.create_multi(db, objs_in=new_items(seed, 1))[0].id),
+    "item.remove_if": lambda db, seed: item.remove_if(
+        db, id=item.create_multi(db, objs_in=new_items(seed, 1))[0].id
+    ),
+    "item.remove_multi": lambda db, seed: item.remove_multi(
+        db, ids=[db_obj.id for db_obj in item.create_multi(db, objs_in=new_items(seed, 5))]
+    ),
+    # CRUDItem
+    "item.create_with_owner": lambda db, seed: item.create_with_owner(
+        db, obj_in=ItemCreate(title="x"), owner_id=seed.user_id
+    ),
+    "item.create_multi_with_owner": lambda db, seed: item.create_multi_with_owner(
+        db, objs_in=[ItemCreate(title="x")] * 10, owner_id=seed.user_id
+    ),
+    "item.copy_with_owner": lambda db, seed: item.copy_with_owner(
+        db, chunks=[[ItemCreate(title="x")] * 10], owner_id=seed.user_id
+    ),
+    "item.update_by_owner": lambda db, seed: item.update_by_owner(
+        db, id=seed.item_id, obj_in={"title": "x"}, owner_id=seed.user_id
+    ),
+    "item.remove_by_owner": lambda db, seed: item.remove_by_owner(
+        db, id=item.create_multi(db, objs_in=new_items(seed, 1))[0].id, owner_id=seed.user_id
+    ),
+    "item.search": lambda db, seed: item.search(db, q=RARE_WORD, limit=100),
+    "item.search.owner": lambda db, seed: item.search(db, q="lamp", owner_id=seed.user_id, limit=100),
+    "item.count": lambda db, seed: item.count(db),
+    "item.count.estimate": lambda db, seed: item.count(db, exact=False),
+    "item.count.owner": lambda db, seed: item.count(db, owner_id=seed.user_id),
+    "item.owner_counts": lambda db, seed: item.owner_counts(db, limit=100),
+    "item.get_multi_by_owner": lambda db, seed: item.get_multi_by_owner(db, owner_id=seed.user_id, limit=100),
+    "item.stream": lambda db, seed: first_batch(item.stream(db, batch_size=100)),
+    "item.stream.owner": lambda db, seed: first_batch(item.stream(db, owner_id=seed.user_id, batch_size=100)),
+    # CRUDUser
+    "user.get_cached": lambda db, seed: user.get_cached(db, id=seed.user_id),
+    "user.get_by_email": lambda db, seed: user.get_by_email(db, email=seed.email),
+    "user.authenticate": lambda db, seed: user.authenticate(db, email=random_email(), password="x"),
+    "user.create": lambda db, seed: user.create(
+        db, obj_in=UserCreate(email=random_email(), password="x"), hashed_password="x"
+    ),
+    "user.update": lambda db, seed: user.update(db, db_obj=user.get(db, id=seed.user_id), obj_in={"full_name": "x"}),
+    # CRUDRefreshSession
+    "refresh_session.get_by_token": lambda db, seed: refresh_session.get_by_token(db, token=new_session(db, seed)),
+    "refresh_session.get_active": lambda db, seed: refresh_session.get_active(
+        db, user_id=seed.user_id, fingerprint="fingerprint 1"
+    ),
+    "refresh_session.upsert": lambda db, seed: refresh_session.upsert(db, obj_in=RefreshSessionCreate(
+        user_id=seed.user_id, refresh_token=random_lower_string(), fingerprint="x", expires_delta=timedelta(days=1)
+    )),
+    "refresh_session.remove_expired": lambda db, seed: refresh_session.remove_expired(db, limit=100),
+    "refresh_session.remove_by_token": lambda db, seed: refresh_session.remove_by_token(
+        db, token=new_session(db, seed)
+    ),
+    "refresh_session.rotate": lambda db, seed: refresh_session.rotate(
+        db, token=new_session(db, seed), fingerprint="x", new_token=random_lower_string(),
+        expires_delta=timedelta(days=1)
+    ),
+}
+
+
+@pytest.mark.parametrize("name", list(CASES))
+def test_no_sequential_scan_of_large_tables(
+        connection: Connection,
+        db: Session,
+        seed: Seed,
+        large_tables: set[str],
+        name: str
+) -> None:
+    plans = explained_statements(connection, lambda: CASES[name](db, seed))
+    assert plans
+    scans = [
+        (statement, table) for statement, plan in plans for table in sequential_scans(plan) if table in large_tables
+    ]
+    if name not in FULL_SCANS:
+        assert not scans, f"{name} reads large tables sequentially: {scans}"
+
+
+def test_remove_expired_deletes_batch_by_primary_key(connection: Connection, db: Session, seed: Seed) -> None:
+    [(_, plan)] = explained_statements(connection, lambda: refresh_session.remove_expired(db, limit=100))
+    assert plan["Node Type"] == "ModifyTable" and plan["Operation"] == "Delete"
+    # rows of the batch are found by their ids, not by a join reading the table
+    [target] = [node for node in plan["Plans"] if node["Parent Relationship"] == "Outer"]
+    assert target["Node Type"] == "Index Scan" and target["Index Name"] == "refresh_session_pkey"
+    index_names = {node.get("Index Name") for node in nodes(plan)}
+    assert "ix_refresh_session_expires_in" in index_names
+
+
+def test_seeded_tables_are_large(large_tables: set[str]) -> None:
+    assert {"user", "refresh_session", "item_owner_stats"} <= large_tables
+    assert any(table == "item" or table.startswith("item_p") for table in large_tables)
@@ -0,0 +1,79 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.core.hashing import token_digest
+from app.db.session import SessionLocal, engine
+from app.models.refresh_session import RefreshSession
+from app.schemas.refresh_session import RefreshSessionCreate
+from app.tests.utils.user import create_random_user
+from app.tests.utils.utils import count_statements, random_lower_string
+
+
+def create_session(db: Session, *, fingerprint: str = "fp") -> tuple[int, str]:
+    user = create_random_user(db)
+    token = random_lower_string()
+    crud.refresh_session.create(db, obj_in=RefreshSessionCreate(
+        user_id=user.id, refresh_token=token, fingerprint=fingerprint, expires_delta=timedelta(days=1)
+    ))
+    return user.id, token
+
+
+def rotate(token: str, new_token: str, fingerprint: str = "fp") -> int | None:
+    db = SessionLocal()
+    try:
+        return crud.refresh_session.rotate(
+            db, token=token, fingerprint=fingerprint, new_token=new_token, expires_delta=timedelta(days=1)
+        )
+    finally:
+        db.close()
+
+
+def test_rotate_is_single_statement(db: Session) -> None:
+    user_id, token = create_session(db)
+    new_token = random_lower_string()
+    with count_statements(engine) as statements:
+        assert rotate(token, new_token) == user_id
+    assert len(statements) == 1
+    assert crud.refresh_session.get_by_token(db, token=token) is None
+    assert crud.refresh_session.get_by_token(db, token=new_token).user_id == user_id
+
+
+def test_rotate_removes_session_on_fingerprint_mismatch(db: Session) -> None:
+    _, token = create_session(db)
+    assert rotate(token, random_lower_string(), fingerprint="other") is None
+    assert crud.refresh_session.get_by_token(db, token=token) is None
+    assert rotate(token, random_lower_string()) is None
+
+
+def test_concurrent_rotations_of_same_token(db: Session) -> None:
+    user_id, token = create_session(db)
+    new_tokens = [random_lower_string(), random_lower_string()]
+    # the session row is locked until both rotations wait for it, so they run concurrently
+    lock = SessionLocal()
+    try:
+        lock.execute(
+            select(RefreshSession.id).where(RefreshSession.refresh_token_hash == token_digest(token)).with_for_update()
+        )
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(rotate, token, new_token) for new_token in new_tokens]
+            deadline = time.monotonic() + 10
+            while db.execute(text(
+                "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND wait_event_type = 'Lock'"
+            )).scalar() < 2:
+                assert time.monotonic() < deadline, "rotations didn't wait for the session row"
+                db.rollback()
+                time.sleep(0.01)
+            db.rollback()
+            lock.commit()
+            results = [future.result(timeout=10) for future in futures]
+    finally:
+        lock.close()
+    assert sorted(results, key=lambda result: result is None) == [user_id, None]
+    winner = new_tokens[results.index(user_id)]
+    assert crud.refresh_session.get_by_token(db, token=winner).user_id == user_id
+    assert crud.refresh_session.get_by_token(db, token=new_tokens[results.index(None)]) is None
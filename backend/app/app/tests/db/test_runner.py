@@ -0,0 +1,45 @@
+import asyncio
+import threading
+from typing import Any, Sequence
+
+from app.core.response_cache import MemoryCacheBackend, ResponseCache
+from app.db import runner
+from app.db.runner import AsyncSessionRunner
+
+
+class BlockingBackend(MemoryCacheBackend):
+    blocking = True
+
+    def __init__(self) -> None:
+        super().__init__(max_bytes=1024)
+        self.deleted_from: list[tuple[threading.Thread, list[str]]] = []
+
+    def delete(self, keys: Sequence[str]) -> None:
+        self.deleted_from.append((threading.current_thread(), list(keys)))
+        super().delete(keys)
+
+
+class RunSyncSession:
+    # stands in for AsyncSession, its run_sync() calls the function on the event loop thread
+    async def run_sync(self, fn: Any, *args: Any, **kwargs: Any) -> Any:
+        return fn(self, *args, **kwargs)
+
+
+def test_blocking_invalidation_runs_outside_event_loop(monkeypatch) -> None:
+    backend = BlockingBackend()
+    cache = ResponseCache(backend, ttls={"read_item": 60})
+    monkeypatch.setattr(runner, "response_cache", cache)
+
+    def change(_: Any) -> str:
+        cache.invalidate("item:1", "item:2")
+        cache.invalidate("item:1")
+        assert backend.deleted_from == []
+        return "changed"
+
+    async def run() -> str:
+        return await AsyncSessionRunner(RunSyncSession()).run(change)
+
+    assert asyncio.run(run()) == "changed"
+    [(thread, keys)] = backend.deleted_from
+    assert thread is not threading.main_thread()
+    assert keys == ["tag:item:1", "tag:item:2"]
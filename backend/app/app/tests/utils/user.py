@@ -0,0 +1,12 @@
+from typing import Any
+
+from sqlalchemy.orm import Session
+
+from app import crud, models
+from app.schemas.user import UserCreate
+from app.tests.utils.utils import random_email, random_lower_string
+
+
+def create_random_user(db: Session, **fields: Any) -> models.User:
+    user_in = UserCreate(email=random_email(), password=random_lower_string(), **fields)
+    return crud.user.create(db=db, obj_in=user_in)
@@ -5,6 +5,7 @@ python /app/app/backend_pre_start.py
 
 # Run migrations
 alembic upgrade head
+python /app/app/init_item_shards.py
 
 # Create initial data in DB
 python /app/app/initial_data.py
@@ -0,0 +1,7 @@
+#!/usr/bin/env bash
+
+set -e
+set -x
+
+# Tests run against the database of the settings, migrated to head
+pytest app/tests "${@}"